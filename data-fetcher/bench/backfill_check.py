@@ -0,0 +1,110 @@
+""" Interrupted and resumed backfill against the fake history endpoints
+
+    Runs backfill.py's Backfiller twice over the same range. In the first run the fake
+    server stops serving history requests after a while, so some chunks fail. The second
+    run has to do only those chunks. Checks that every point of the range was written
+    exactly as expected, with its source timestamp, and that finished chunks were not
+    downloaded again:
+
+        python3 bench/backfill_check.py
+"""
+import argparse
+import datetime
+import logging
+import os
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+from fake_server import FakeServer  # noqa: E402
+from run import bench_config  # noqa: E402
+
+START = datetime.datetime(2021, 3, 1)
+END = datetime.datetime(2021, 3, 15)
+
+
+def line_time(line: bytes) -> datetime.datetime:
+    return datetime.datetime.utcfromtimestamp(int(line.rsplit(b' ', 1)[1]) / 1e9)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interrupted and resumed backfill against the fake server")
+    parser.add_argument('--size', type=int, default=20, help="number of locations and districts")
+    parser.add_argument('--interrupt-after', type=int, default=20, help="history requests served in the first run")
+    parser.add_argument('--chunk-days', type=int, default=7, help="days per download chunk")
+    args = parser.parse_args()
+
+    # the failed chunks of the first run are expected
+    logging.disable(logging.CRITICAL)
+
+    from backfill import Backfiller, split_range
+    from cache import StateCache
+    from db import Database
+    from fetch import Fetcher
+
+    fake = FakeServer(districts=args.size).start()
+    fake.lines = set()
+    hours = int((END - START).total_seconds() // 3600)
+    expected = hours * args.size + (END - START).days * args.size
+    failures = []
+
+    with tempfile.TemporaryDirectory() as state_dir:
+        config = bench_config(fake, args.size, state_dir)
+        # small pages, so the RKI chunks are paged
+        config['rki']['page_size'] = 50
+        chunks = split_range(START, END, args.chunk_days)
+
+        def backfill() -> tuple:
+            """ (success, jobs left) of one run with a fresh process state but the same checkpoint """
+
+            database = Database(config['influxdb'])
+            fetcher = Fetcher(1, config)
+            backfiller = Backfiller(config, fetcher, database, StateCache(os.path.join(state_dir, 'checkpoint.json')),
+                                    workers=4, rki_url=f"{fake.url}/rki_history",
+                                    weather_url=f"{fake.url}/weather_history")
+            try:
+                success = backfiller.run(backfiller.jobs(chunks))
+                return success, backfiller.jobs(chunks)
+            finally:
+                fetcher.close()
+                database.close()
+
+        total_jobs = len(chunks) * (1 + args.size)
+        fake.history_limit = args.interrupt_after
+        success, left = backfill()
+        print(f"first run:  {'succeeded' if success else 'interrupted'}, "
+              f"{total_jobs - len(left)} of {total_jobs} chunks done, {len(fake.lines)} points written")
+        if success or not left or len(left) == total_jobs:
+            failures.append("the first run was not interrupted part way, try another --interrupt-after")
+
+        weather_left = sum(1 for key, *_ in left if key.startswith('weather:'))
+        fake.history_limit = None
+        requests = fake.weather_history_requests
+        success, left_after = backfill()
+        weather_requests = fake.weather_history_requests - requests
+        print(f"second run: {'succeeded' if success else 'failed'}, {len(left_after)} chunks left, "
+              f"{len(fake.lines)} points written")
+        if not success or left_after:
+            failures.append("the second run did not finish all chunks")
+        # a weather chunk is one request, finished ones must not be downloaded again
+        if weather_requests != weather_left:
+            failures.append(f"the second run made {weather_requests} weather history requests "
+                            f"for {weather_left} weather chunks left")
+        if len(fake.lines) != expected:
+            failures.append(f"{len(fake.lines)} distinct points written, expected {expected}")
+        outside = [line for line in fake.lines if not START <= line_time(line) < END]
+        if outside:
+            failures.append(f"{len(outside)} points are not timestamped within the range, e.g. {outside[0][:80]!r}")
+
+    fake.stop()
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    if not failures:
+        print("OK: the resumed backfill wrote every point of the range with its source time")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+""" Local stand-in for openweathermap, the RKI ArcGIS services and influxdb
+
+    Replays the recorded responses in fixtures/ and accepts influxdb writes and queries,
+    so a full fetch-and-store cycle can run without network access. The history endpoints
+    used by backfill.py (/weather_history, /rki_history) generate hourly weather and daily
+    RKI records for the requested range from the recorded ones.
+"""
+import copy
+import datetime
+import gzip
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import re
+import sys
+from threading import Lock, Thread
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+
+
+class _HTTPServer(ThreadingHTTPServer):
+    # many concurrent connects from the fetch engine, the default backlog of 5 stalls them
+    request_queue_size = 1024
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients closing their pooled keep-alive connections are not an error
+        if not isinstance(sys.exc_info()[1], ConnectionResetError):
+            super().handle_error(request, client_address)
+
+
+def load_fixture(name: str) -> dict:
+    with open(os.path.join(FIXTURE_DIR, name), 'r') as file:
+        return json.load(file)
+
+
+class FakeServer:
+    """ Serves /weather, /rki_status, /rki_key_data and the influxdb /ping, /write and /query endpoints """
+
+    def __init__(self, districts: int = 1, host: str = '127.0.0.1', port: int = 0):
+        self.districts = districts
+        self.weather = json.dumps(load_fixture('weather.json')).encode()
+        self.rki_status = json.dumps(load_fixture('rki_status.json')).encode()
+        self.rki_record = load_fixture('rki_key_data.json')['features'][0]['attributes']
+        self.weather_record = load_fixture('weather.json')
+        self.rki_history_record = load_fixture('rki_history.json')['features'][0]['attributes']
+        self.lock = Lock()
+        self.written_points = 0
+        self.write_requests = 0
+        self.queries = 0
+        # influxdb answers writes with 503 while set
+        self.outage = False
+        # history requests beyond this number are answered with 503, None serves all
+        self.history_limit = None
+        self.history_requests = 0
+        self.weather_history_requests = 0
+        # set of the written lines if it is a set, e.g. to check for missing or duplicate points
+        self.lines = None
+        self.httpd = _HTTPServer((host, port), self._handler())
+        self.thread = Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def port(self) -> int:
+        return self.httpd.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def rki_page(self, offset: int, count: int) -> bytes:
+        """ Page of rki_key_data_v with one record per district, generated from the recorded record """
+
+        features = []
+        for index in range(offset, min(offset + count, self.districts)):
+            attributes = copy.copy(self.rki_record)
+            attributes['AdmUnitId'] = 1000 + index
+            attributes['BundeslandId'] = index % 16 + 1
+            attributes['ObjectId'] = index + 1
+            features.append({'attributes': attributes})
+        body = {'features': features, 'exceededTransferLimit': offset + count < self.districts}
+
+        return json.dumps(body).encode()
+
+    def history_allowed(self, path: str) -> bool:
+        with self.lock:
+            self.history_requests += 1
+            if path == '/weather_history':
+                self.weather_history_requests += 1
+            return self.history_limit is None or self.history_requests <= self.history_limit
+
+    def weather_history(self, start: int, end: int) -> bytes:
+        """ Hourly records of the openweathermap history API from start to end (epoch seconds) """
+
+        records = [dict(self.weather_record, dt=timestamp) for timestamp in range(start, end, 3600)]
+
+        return json.dumps({'cnt': len(records), 'list': records}).encode()
+
+    def rki_history(self, where: str, offset: int, count: int) -> bytes:
+        """ Page of rki_history_hubv with one record per district and day of the range in `where` """
+
+        start, end = (datetime.datetime.strptime(value, '%Y-%m-%d %H:%M:%S').replace(tzinfo=datetime.timezone.utc)
+                      for value in re.findall(r"timestamp '([^']+)'", where))
+        district = re.search(r'AdmUnitId = (\d+)', where)
+        districts = [int(district.group(1))] if district else [1000 + index for index in range(self.districts)]
+        days = (end - start).days
+        total = days * len(districts)
+
+        features = []
+        for index in range(offset, min(offset + count, total)):
+            day, position = divmod(index, len(districts))
+            attributes = dict(self.rki_history_record)
+            attributes['Datum'] = int((start + datetime.timedelta(days=day)).timestamp() * 1000)
+            attributes['AdmUnitId'] = districts[position]
+            attributes['BundeslandId'] = districts[position] % 16 + 1
+            features.append({'attributes': attributes})
+        body = {'features': features, 'exceededTransferLimit': offset + count < total}
+
+        return json.dumps(body).encode()
+
+    def query_result(self, statements: str) -> bytes:
+        now = datetime.datetime.utcnow().isoformat() + 'Z'
+        results = []
+        for statement_id, statement in enumerate(statements.split(';')):
+            selection, _, source = statement.strip()[len('SELECT'):].partition(' FROM ')
+            columns = [column.split(' AS ')[-1].strip().strip('"') for column in selection.split(',')]
+            values = [now] + [1.0 for _ in columns]
+            name = source.split()[0].strip('"') if source else ''
+            results.append({'statement_id': statement_id,
+                            'series': [{'name': name, 'columns': ['time'] + columns, 'values': [values]}]})
+
+        return json.dumps({'results': results}).encode()
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, body: bytes = b'', content_type: str = 'application/json'):
+                self.send_response(status)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('X-Influxdb-Version', '1.8.10')
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                query = parse_qs(url.query)
+                if url.path == '/weather':
+                    self._send(200, server.weather)
+                elif url.path == '/rki_status':
+                    self._send(200, server.rki_status)
+                elif url.path == '/rki_key_data':
+                    offset = int(query.get('resultOffset', ['0'])[0])
+                    count = int(query.get('resultRecordCount', [str(server.districts)])[0])
+                    self._send(200, server.rki_page(offset, count))
+                elif url.path in ('/weather_history', '/rki_history'):
+                    if not server.history_allowed(url.path):
+                        self._send(503, b'{}')
+                    elif url.path == '/weather_history':
+                        self._send(200, server.weather_history(int(query['start'][0]), int(query['end'][0])))
+                    else:
+                        offset = int(query.get('resultOffset', ['0'])[0])
+                        count = int(query.get('resultRecordCount', ['1000'])[0])
+                        self._send(200, server.rki_history(query['where'][0], offset, count))
+                elif url.path == '/ping':
+                    self._send(204)
+                elif url.path == '/query':
+                    with server.lock:
+                        server.queries += 1
+                    self._send(200, server.query_result(query.get('q', [''])[0]))
+                else:
+                    self._send(404, b'{}')
+
+            def do_POST(self):
+                url = urlsplit(self.path)
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if url.path == '/query':
+                    with server.lock:
+                        server.queries += 1
+                    self._send(200, server.query_result(parse_qs(body.decode()).get('q', [''])[0]))
+                    return
+                if url.path != '/write':
+                    self._send(404, b'{}')
+                    return
+                if server.outage:
+                    self._send(503, b'{"error": "outage"}')
+                    return
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = gzip.decompress(body)
+                lines = [line for line in body.split(b'\n') if line]
+                with server.lock:
+                    if server.lines is not None:
+                        server.lines.update(lines)
+                    server.written_points += len(lines)
+                    server.write_requests += 1
+                self._send(204)
+
+        return Handler
+
+
+if __name__ == '__main__':
+    fake = FakeServer(districts=400).start()
+    print(f"Fake APIs and influxdb listening on {fake.url}")
+    fake.thread.join()
@@ -0,0 +1,193 @@
+""" Offline benchmark of the fetch-and-store cycle and the notifier check
+
+    Runs every stage against the local stand-in in fake_server.py and reports latency,
+    throughput and peak RSS per problem size (number of locations and districts):
+
+        python3 bench/run.py --sizes 1,100,10000
+
+    Each size runs in its own interpreter, so the peak RSS is not inflated by earlier sizes.
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'src'))
+
+from fake_server import FakeServer  # noqa: E402
+
+# cycles fetched while influxdb is down before the wal_replay stage, an hour of one minute cycles
+OUTAGE_CYCLES = 60
+
+
+def bench_config(fake: FakeServer, size: int, state_dir: str) -> dict:
+    """ Config as returned by get_config, pointing every endpoint at the fake server """
+
+    return {
+        "general": {
+            "sampling_time": 60,
+            "max_concurrent_requests": 100,
+            "requests_per_second": 100000,
+            "requests_per_key": 0,
+            "cache_path": os.path.join(state_dir, 'cache.json'),
+            "metrics_port": 0,
+            "connect_timeout": 5,
+            "read_timeout": 30,
+            "sources": ["weather", "rki_status", "rki_key_data"],
+            "notify_in_process": False
+        },
+        "openweatherapi": {"api_key": "bench"},
+        "urls": {
+            "weather": f"{fake.url}/weather",
+            "rki_status": f"{fake.url}/rki_status",
+            "rki_key_data": f"{fake.url}/rki_key_data"
+        },
+        "rki": {"bulk": True, "page_size": 1000, "stream": True},
+        "mail": {
+            "mail_user": "bench@localhost", "mail_password": None, "mail_host": "127.0.0.1",
+            "mail_port": 0, "mail_recipient": "bench@localhost",
+            "starttls": False, "idle_timeout": 60, "digest_window": 0
+        },
+        "notifier": {
+            "max_age_hours": 1, "age_check_interval": 0, "low_temp_threshold": -50,
+            "high_temp_threshold": 50, "incidence_threshold": 100000, "temp_window": '30m',
+            "lookback": '7d', "state_path": ':memory:', "temp_hysteresis": 1, "incidence_hysteresis": 5,
+            "alert_cooldown": 3600, "alert_dedup_window": 3600, "age_alert_cooldown": 21600
+        },
+        "locations": [{"name": f"loc{index}", "lat": 51.0 + index / 1e4, "lon": 7.0} for index in range(size)],
+        "influxdb": {
+            "username": "bench", "password": "bench", "host": "127.0.0.1", "dbname": "bench",
+            "port": fake.port, "table_weather": "wetter", "table_rki": "rki",
+            "batch_size": 5000, "flush_interval": 1, "buffer_size": 50000,
+            "wal_path": state_dir, "wal_max_points": 10000000
+        }
+    }
+
+
+def timed(stages: dict, name: str, function, *args):
+    """ Run function(*args), record its duration and the number of points it produced """
+
+    start = time.perf_counter()
+    result = function(*args)
+    seconds = time.perf_counter() - start
+    points = len(result) if isinstance(result, list) else result or 0
+    stages[name] = {
+        "seconds": round(seconds, 4),
+        "points": points,
+        "points_per_second": round(points / seconds) if seconds > 0 and points else None
+    }
+
+    return result
+
+
+def run_size(size: int) -> dict:
+    """ Benchmark all stages for `size` locations and districts in this process """
+
+    import logging
+    logging.disable(logging.CRITICAL)
+
+    from alerts import AlertStateStore
+    from app import make_store
+    from cache import StateCache
+    from db import Database
+    from fetch import Fetcher
+    from notifier import RuleEngine, check, create_mailer
+    from rules import build_rules
+    from sources import SourceRunner, create_sources
+
+    fake = FakeServer(districts=size).start()
+    stages = {}
+    with tempfile.TemporaryDirectory() as state_dir:
+        config = bench_config(fake, size, state_dir)
+        database = Database(config['influxdb'])
+        fetcher = Fetcher(1, config)
+
+        weather = timed(stages, 'fetch_weather', lambda: fetcher.weather_datapoints(fetcher.get_weather()))
+        rki = timed(stages, 'fetch_rki_bulk',
+                    lambda: [point for page in fetcher.iter_datapoints_rki_bulk() for point in page])
+
+        def write(points):
+            database.save_to_database(points, False)
+            database.flush()
+            return len(points)
+        timed(stages, 'write', write, weather + rki)
+
+        def cycle():
+            written = fake.written_points
+            # the fake server always answers with the same `dt`, which the first stage already stored
+            fetcher.weather_times.clear()
+            cache = StateCache(config['general']['cache_path'])
+            SourceRunner(create_sources(config, fetcher, cache), make_store(database),
+                         config['general']['sampling_time']).run()
+            database.flush()
+            return fake.written_points - written
+        timed(stages, 'fetch_and_store_cycle', cycle)
+
+        # points of the cycles during an outage wait in the write-ahead log, the stage is the replay
+        fake.outage = True
+        for _ in range(OUTAGE_CYCLES):
+            database.save_to_database(weather + rki, False)
+        fake.outage = False
+
+        def replay():
+            written = fake.written_points
+            database.flush()
+            return fake.written_points - written
+        timed(stages, 'wal_replay', replay)
+
+        mailer = create_mailer(config)
+        engine = RuleEngine(build_rules(config), mailer, '7d', AlertStateStore(':memory:'))
+        timed(stages, 'notifier_check', check, engine, database)
+
+        fetcher.close()
+        database.close()
+        mailer.close()
+    fake.stop()
+
+    return {
+        "size": size,
+        "stages": stages,
+        "write_requests": fake.write_requests,
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def print_report(results: list):
+    print(f"{'size':>7} {'stage':<24} {'seconds':>9} {'points':>8} {'points/s':>10}")
+    for result in results:
+        for name, stage in result['stages'].items():
+            rate = stage['points_per_second'] or ''
+            print(f"{result['size']:>7} {name:<24} {stage['seconds']:>9.4f} {stage['points']:>8} {rate:>10}")
+        print(f"{result['size']:>7} {'peak RSS (MB)':<24} {result['peak_rss_mb']:>9}"
+              f"   influxdb write requests: {result['write_requests']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of data-fetcher and notifier")
+    parser.add_argument('--sizes', default='1,100,10000', help="comma separated numbers of locations/districts")
+    parser.add_argument('--json', help="also write the results to this file")
+    parser.add_argument('--single', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.single is not None:
+        print(json.dumps(run_size(args.single)))
+        return
+
+    results = []
+    for size in (int(size) for size in args.sizes.split(',')):
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), '--single', str(size)],
+                                check=True, capture_output=True, text=True).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
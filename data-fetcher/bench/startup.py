@@ -0,0 +1,116 @@
+""" Cold start and memory of the fetcher and the notifier
+
+    Starts both services, but stops them once they imported their modules and what their
+    first tick needs (without ring buffer and without sending mail). Reports the wall time
+    until both are ready and the memory of all their processes. Memory is the PSS
+    (proportional set size), so pages shared between forked processes are counted once:
+
+        python3 bench/startup.py --repeat 5
+
+    Variants:
+        separate  two interpreters (python3 -m wetter run fetcher / notifier)
+        forked    one interpreter that imports the shared modules and forks both services
+                  (python3 -m wetter run fetcher notifier, as in docker-compose.yml)
+"""
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+
+# modules the services import at startup and on their first tick
+RUNTIME = {
+    'fetcher': ['app', 'influxdb', 'async_fetch'],
+    'notifier': ['notifier', 'influxdb']
+}
+
+# every process prints its pid once ready and waits to be measured
+_READY = "os.write(1, f'{os.getpid()}\\n'.encode())\ntime.sleep(600)\nos._exit(0)\n"
+_HEADER = f"import gc, importlib, os, sys, time\nsys.path.insert(0, {SRC_DIR!r})\n"
+
+
+def service(modules: list) -> str:
+    return _HEADER + ''.join(f"importlib.import_module({name!r})\n" for name in modules) + _READY
+
+
+def forked() -> str:
+    """ Like wetter.fork(): import the shared modules, then fork one child per service """
+
+    return (_HEADER + "import wetter\n"
+            "for name in wetter.PRELOAD + [wetter.SERVICES['fetcher'], wetter.SERVICES['notifier']]:\n"
+            "    importlib.import_module(name)\n"
+            "gc.freeze()\n"
+            f"for modules in {list(RUNTIME.values())!r}:\n"
+            "    if os.fork() == 0:\n"
+            "        for name in modules:\n"
+            "            importlib.import_module(name)\n"
+            "        " + _READY.replace('\n', '\n        ') + "\n"
+            + _READY)
+
+
+VARIANTS = {
+    'separate': [(service(modules), 1) for modules in RUNTIME.values()],
+    'forked': [(forked(), 3)]
+}
+
+
+def memory_kb(pid: int) -> int:
+    """ PSS of a process, its RSS where smaps_rollup is not available """
+
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as file:
+            return next(int(line.split()[1]) for line in file if line.startswith('Pss:'))
+    except OSError:
+        with open(f'/proc/{pid}/status') as file:
+            return next(int(line.split()[1]) for line in file if line.startswith('VmRSS:'))
+
+
+def measure(variant: str) -> tuple:
+    """ (seconds until all processes are ready, memory of all processes in MB) """
+
+    start = time.perf_counter()
+    processes = [(subprocess.Popen([sys.executable, '-c', code], stdout=subprocess.PIPE, text=True,
+                                   start_new_session=True), ready) for code, ready in VARIANTS[variant]]
+    pids = []
+    try:
+        for process, ready in processes:
+            pids += [int(process.stdout.readline()) for _ in range(ready)]
+        seconds = time.perf_counter() - start
+        memory = sum(memory_kb(pid) for pid in pids) / 1024
+    finally:
+        for process, _ in processes:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.wait()
+
+    return seconds, memory
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold start and memory of fetcher and notifier")
+    parser.add_argument('--repeat', type=int, default=5, help="runs per variant, the median is reported")
+    parser.add_argument('--json', help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'variant':<10} {'seconds':>9} {'memory (MB)':>12}")
+    for variant in VARIANTS:
+        runs = [measure(variant) for _ in range(args.repeat)]
+        result = {
+            "variant": variant,
+            "seconds": round(statistics.median(seconds for seconds, _ in runs), 4),
+            "memory_mb": round(statistics.median(memory for _, memory in runs), 1)
+        }
+        results.append(result)
+        print(f"{variant:<10} {result['seconds']:>9.4f} {result['memory_mb']:>12}")
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+import logging
+import sqlite3
+from threading import Lock
+
+
+class AlertState:
+    """ State of one alert: whether it is active, when that last changed and when it was last mailed """
+
+    __slots__ = ('active', 'changed', 'last_sent')
+
+    def __init__(self, active: bool = False, changed: float = None, last_sent: float = None):
+        self.active = active
+        self.changed = changed
+        self.last_sent = last_sent
+
+
+class AlertStateStore:
+    """ Alert states of all rules, cached in memory and persisted in a small SQLite file
+
+        The file is only written when a state changes, not on every tick. Use ':memory:' to
+        keep the states for the lifetime of the process only.
+    """
+
+    def __init__(self, path: str = ':memory:'):
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS alert_state ("
+            "rule TEXT NOT NULL, key TEXT NOT NULL, active INTEGER NOT NULL, "
+            "changed REAL, last_sent REAL, PRIMARY KEY (rule, key))")
+        self.connection.commit()
+        self.states = {}
+        for rule, key, active, changed, last_sent in self.connection.execute(
+                "SELECT rule, key, active, changed, last_sent FROM alert_state"):
+            self.states[(rule, key)] = AlertState(bool(active), changed, last_sent)
+        logging.info(f"Loaded {len(self.states)} alert states from '{path}'")
+
+    def get(self, rule: str, key: str) -> AlertState:
+        with self.lock:
+            state = self.states.get((rule, key))
+            return AlertState(state.active, state.changed, state.last_sent) if state else AlertState()
+
+    def active_keys(self, rule: str) -> set:
+        with self.lock:
+            return {key for (name, key), state in self.states.items() if name == rule and state.active}
+
+    def put(self, rule: str, key: str, state: AlertState):
+        with self.lock:
+            self._put(rule, key, state)
+
+    def restore(self, rule: str, key: str, sent: float, previous: AlertState):
+        """ Put back the state from before the mail sent at `sent`, which could not be delivered
+
+            Nothing changes if the alert changed since, e.g. it cleared or was mailed again.
+        """
+
+        with self.lock:
+            known = self.states.get((rule, key))
+            if known is not None and known.last_sent == sent:
+                logging.info(f"Alert '{rule}' {key} was not delivered, it is sent again on its next trigger")
+                self._put(rule, key, previous)
+
+    def _put(self, rule: str, key: str, state: AlertState):
+        known = self.states.get((rule, key))
+        if known is not None and (known.active, known.changed, known.last_sent) == \
+                (state.active, state.changed, state.last_sent):
+            return
+        self.states[(rule, key)] = state
+        self.connection.execute(
+            "INSERT OR REPLACE INTO alert_state (rule, key, active, changed, last_sent) VALUES (?, ?, ?, ?, ?)",
+            (rule, key, int(state.active), state.changed, state.last_sent))
+        self.connection.commit()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+def should_send(rule, state: AlertState, now: float) -> bool:
+    """ Decide whether a triggered alert is mailed, based on the cooldown and dedup window of its rule
+
+        - cooldown: at least this many seconds between two mails of the same alert
+        - dedup_window: an alert that cleared less than this many seconds ago and
+          triggers again counts as the same incident and is not mailed again
+        - repeat: active alerts are mailed again once the cooldown has passed
+    """
+
+    if state.last_sent is not None and now - state.last_sent < rule.cooldown:
+        return False
+    if state.active:
+        return rule.repeat
+    if state.last_sent is not None and state.changed is not None and now - state.changed < rule.dedup_window:
+        return False
+
+    return True
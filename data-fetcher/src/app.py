@@ -1,14 +1,29 @@
-import datetime
 import logging
-from threading import Thread
-import time
+import sys
+from typing import TYPE_CHECKING
 
+from alerts import AlertStateStore
+from cache import StateCache
 from config import get_config
 from db import Database
+from dedup import ChangeFilter
 from fetch import Fetcher
+from metrics import start_metrics_server
+from notifier import RuleEngine, create_mailer
+from retention import RetentionManager
+from rules import build_rules
+from scheduler import AdaptiveScheduler, Scheduler, SourceSchedule
+from sources import Batch, SourceRunner, chain_interval, chain_sources, create_sources, poll_chain
+from tenants import create_database, targets
+from workers import Supervisor
+
+if TYPE_CHECKING:
+    # numpy is only imported when a ring buffer is configured
+    from ringbuffer import RingBuffer
 
 def main():
-    """Main loop of the program, calls the subprocesses after 10 seconds if they are not running"""
+    """Main loop of the program, polls the sources (SOURCES) once every sampling period or
+    every source on its own schedule (ADAPTIVE_SCHEDULING)"""
 
     # Set format of log messages
     logging.basicConfig(
@@ -16,9 +31,6 @@ def main():
         datefmt='[%Y-%m-%d %H:%M:%S]',
         level=logging.INFO)
 
-    # Initialize the monitoring process
-    process = None
-
     # Read credentials/config from json file
     config = get_config()
 
@@ -26,48 +38,132 @@ def main():
     sampling_period = config['general']['sampling_time']
     logging.info(f'sampling_period: {sampling_period} sec')
 
-    # Start processes for data retrieval from apis and writing to database
-    while True:
+    if config['general']['metrics_port']:
+        start_metrics_server(config['general']['metrics_port'])
+
+    # Database connection and HTTP sessions live as long as the process
+    # with profiles (PROFILES_PATH) the points are fanned out to the influxdb of every profile
+    database = create_database(config)
+    cache = StateCache(config['general']['cache_path'])
+    fetcher = Fetcher(1, config, cache)
+    general = config['general']
+    sources = create_sources(config, fetcher, cache)
+    ring = None
+    if general['ring_path']:
         try:
-            fetcher_thread = Thread(target=fetch_and_store_data, args=(config,))
-            logging.info("Child thread started: fetch_and_store_data")
-            fetcher_thread.start()
-            while fetcher_thread.is_alive():
-                fetcher_thread.join(sampling_period)
-                logging.info("Child thread stopped: fetch_and_store_data")
-        except RuntimeError as error:
-            logging.error(error)
-        except (KeyboardInterrupt, SystemExit):
-            print('Application terminated by keyboard interrupt (ctrl-c).')
-            sys.exit()
-        time.sleep(sampling_period)
-
-def fetch_and_store_data(config: dict):
-    """ read out system data and store in database """
+            from ringbuffer import RingBuffer
+        except ImportError:
+            raise RuntimeError("RING_BUFFER_PATH needs numpy, install it with 'pip3 install numpy'")
+        ring = RingBuffer(general['ring_path'], general['ring_size'], general['ring_fields'])
+    # fetch jobs run on a bounded pool, each with a deadline, so a hanging API cannot stall the others
+    supervisor = Supervisor(general['fetch_workers'], general['fetch_deadline'])
+    dedup = config['dedup']
+    changes = ChangeFilter(dedup['state_path'], dedup['deadbands'], dedup['heartbeat']) if dedup['enabled'] else None
 
-    logging.info('Starting retrieval of data.')
-    date_today = datetime.datetime.now().strftime("%Y-%d-%m")
-    runNo = 1
-    be_verbose = False
-
-    database = Database(config['influxdb'])
-    fetcher = Fetcher(runNo, config)
-
-    logging.info("Fetching weather data from openweathermap API")
-    data_weather = fetcher.prepare_datapoints_weather()
-    database.save_to_database(data_weather, be_verbose)
-
-    date_rki = fetcher.check_status_api()
-    if date_today != date_rki:
-        last_object_id_in_db = list(database.get_last_object_id())[0][0]['ObjectId']
-        data_rki = fetcher.prepare_datapoints_rki()
-        rki_object_id = data_rki[0]['fields']['ObjectId']
-        if rki_object_id != last_object_id_in_db:
-            logging.info(f"object_id: {rki_object_id} not found in database")
-            logging.info("Fetching Corona data from RKI API")
-            database.save_to_database(data_rki, be_verbose)
+    if config['retention']['enabled']:
+        apply_retention(config, database)
+
+    # Optionally evaluate the notification rules in this process on the freshly fetched points
+    engine = None
+    if config['general']['notify_in_process']:
+        engine = RuleEngine(build_rules(config), create_mailer(config), config['notifier']['lookback'],
+                            AlertStateStore(config['notifier']['state_path']))
+        try:
+            engine.refresh(database)
+        except Exception as err:
+            logging.warning(f"Could not load latest datapoints for the notifier: {err}")
+
+    # Fetch data from the apis and write it to the database on every tick, or poll every api
+    # just after it is expected to have new data
+    try:
+        if general['adaptive']:
+            create_adaptive_scheduler(config, database, sources, cache, engine, ring, changes, supervisor).run()
         else:
-            logging.info("Corona data is up to date!")
+            runner = SourceRunner(sources, make_store(database, engine, ring, changes), sampling_period, supervisor)
+            Scheduler(sampling_period).run(run_tick, database, runner, engine)
+    except (KeyboardInterrupt, SystemExit):
+        print('Application terminated by keyboard interrupt (ctrl-c).')
+        sys.exit()
+    finally:
+        supervisor.close()
+        fetcher.close()
+        database.close()
+        if ring is not None:
+            ring.close()
+        if changes is not None:
+            changes.close()
+        if engine is not None:
+            engine.mailer.close()
+            engine.states.close()
+
+def apply_retention(config: dict, database):
+    """ Create the retention policies and rollups in influxdb, in the one of every profile if there are any """
+
+    for target, target_config in targets(config, database):
+        try:
+            RetentionManager(target, target_config).apply()
+        except Exception as err:
+            logging.warning(f"Could not set up retention policies and rollups in '{target.database}': {err}")
+
+def create_adaptive_scheduler(config: dict, database: Database, sources: list, cache: StateCache,
+                              engine: RuleEngine = None, ring: 'RingBuffer' = None,
+                              changes: ChangeFilter = None, supervisor: Supervisor = None) -> AdaptiveScheduler:
+    """ Scheduler polling every chain of sources at the update interval learned from its data
+
+        What was learned is kept in the cache. Whenever polls ended the points of those
+        sources are stored together and the rule engine is checked.
+    """
+
+    general = config['general']
+    batch = Batch(make_store(database, engine, ring, changes))
+
+    def after():
+        batch.flush()
+        if engine is not None:
+            engine.tick(database=database)
+
+    scheduler = AdaptiveScheduler(
+        after=after,
+        save=lambda name, state: cache.update(**{f'schedule_{name}': state}),
+        supervisor=supervisor)
+    for chain in chain_sources(sources):
+        name = chain[0].name
+        schedule = SourceSchedule(name, chain_interval(chain, general['sampling_time']),
+                                  margin=general['poll_margin'], max_backoff=general['max_backoff'],
+                                  state=cache.get(f'schedule_{name}'))
+        scheduler.add(schedule, poll_chain, chain, batch)
+
+    return scheduler
+
+def run_tick(database: Database, runner: SourceRunner, engine: RuleEngine = None):
+    """ fetch and store data, then check the notification rules if they run in this process """
+
+    logging.info('Starting retrieval of data.')
+    # no ping of influxdb here, the writer thread notices an outage and the points stay queued
+    try:
+        runner.run()
+    finally:
+        if engine is not None:
+            engine.tick(database=database)
+
+def make_store(database: Database, engine: RuleEngine = None, ring: 'RingBuffer' = None,
+               changes: ChangeFilter = None, be_verbose: bool = False):
+    """ Function queueing points for the database and handing them to the rule engine and
+        the ring buffer of recent readings if given. With a ChangeFilter only points that
+        changed are written, the rule engine and the ring buffer still get all of them.
+        Points stored with dedup=False bypass the ChangeFilter.
+    """
+
+    def store(datapoints: list, dedup: bool = True):
+        changed = changes.filter(datapoints) if changes is not None and dedup else datapoints
+        if changed:
+            database.save_to_database(changed, be_verbose)
+        if engine is not None:
+            engine.observe(datapoints)
+        if ring is not None:
+            ring.append(datapoints)
+
+    return store
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
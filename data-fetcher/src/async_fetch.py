@@ -0,0 +1,141 @@
+import asyncio
+from concurrent.futures import TimeoutError as FutureTimeout
+import logging
+from threading import Lock, Thread
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from decode import loads
+from metrics import HTTP_LATENCY, JSON_DECODE
+
+
+class HostRateLimiter:
+    """ Token bucket that limits the number of requests per second to one host """
+
+    def __init__(self, rate: float, burst: int = None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """ Wait until a token is available and consume it """
+
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class AsyncFetchEngine:
+    """ Runs many GET requests concurrently over one pooled keep-alive session
+
+        The engine owns its event loop, which runs in a background thread started on
+        first use, so it can be driven from synchronous code, also from several fetch
+        jobs at once. The session is opened lazily and reused for every batch.
+    """
+
+    def __init__(self, max_concurrency: int = 20, rate_per_host: float = 10.0, timeout: float = 10.0,
+                 connect_timeout: float = None, rate_per_key: float = None, key_param: str = 'appid'):
+        self.max_concurrency = max_concurrency
+        self.rate_per_host = rate_per_host
+        # requests with the API key in params[key_param] are limited per key as well
+        self.rate_per_key = rate_per_key
+        self.key_param = key_param
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+        self.lock = Lock()
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.limiters = {}
+        self.session = None
+
+    async def _get_session(self):
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.max_concurrency, keepalive_timeout=60, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout, sock_connect=self.connect_timeout))
+        return self.session
+
+    def _limiter(self, url: str):
+        host = urlsplit(url).hostname
+        if host not in self.limiters:
+            self.limiters[host] = HostRateLimiter(self.rate_per_host)
+        return self.limiters[host]
+
+    def _key_limiter(self, params: dict):
+        """ Limiter of the API key in the params, None without a key or per key rate """
+
+        key = params.get(self.key_param) if self.rate_per_key else None
+        if not key:
+            return None
+        if ('key', key) not in self.limiters:
+            self.limiters[('key', key)] = HostRateLimiter(self.rate_per_key)
+        return self.limiters[('key', key)]
+
+    async def _get_json(self, session, url: str, params: dict, api: str):
+        # waiting for the token of a key does not hold a slot other keys could use
+        key_limiter = self._key_limiter(params)
+        if key_limiter is not None:
+            await key_limiter.acquire()
+        async with self.semaphore:
+            await self._limiter(url).acquire()
+            start = time.perf_counter()
+            async with session.get(url, params=params) as response:
+                response.raise_for_status()
+                body = await response.read()
+            HTTP_LATENCY.observe(time.perf_counter() - start, api=api)
+        with JSON_DECODE.time(api=api):
+            return loads(body)
+
+    async def _gather(self, requests: list, api: str = None):
+        session = await self._get_session()
+        tasks = [self._get_json(session, url, params, api or urlsplit(url).hostname) for url, params in requests]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def get_many(self, requests: list, timeout: float = None, api: str = None) -> list:
+        """ Fetch a list of (url, params) tuples, results are returned in the same order.
+            Failed requests are returned as the raised exception. The latency is recorded
+            under `api` (e.g. 'weather'), by default under the host name.
+
+            With a timeout the requests still running after that many seconds (including
+            those waiting for the rate limiters) are cancelled and TimeoutError is raised.
+        """
+
+        with self.lock:
+            if self.thread is None:
+                self.thread = Thread(target=self.loop.run_forever, name='fetch-loop', daemon=True)
+                self.thread.start()
+        start = time.monotonic()
+        future = asyncio.run_coroutine_threadsafe(self._gather(requests, api), self.loop)
+        try:
+            results = future.result(timeout)
+        except FutureTimeout:
+            future.cancel()
+            raise TimeoutError(f"{len(requests)} requests did not finish within {timeout:.0f} sec") from None
+        logging.info(f"Fetched {len(requests)} requests in {time.monotonic() - start:.2f} sec")
+
+        return results
+
+    def close(self):
+        """ Close the session and the event loop """
+
+        if self.session is not None and not self.session.closed:
+            if self.thread is not None:
+                asyncio.run_coroutine_threadsafe(self.session.close(), self.loop).result()
+            else:
+                self.loop.run_until_complete(self.session.close())
+        if self.thread is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        self.loop.close()
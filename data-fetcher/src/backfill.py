@@ -0,0 +1,159 @@
+""" Backfill historical RKI and weather data into influxdb
+
+    Splits a date range into chunks, downloads the chunks on a worker pool and writes
+    them through the batched write buffer. Finished chunks are recorded in a checkpoint
+    file, so an interrupted backfill continues where it stopped when started again:
+
+        python3 src/backfill.py --start 2021-03-01 --end 2021-04-01 --chunk-days 7
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import datetime
+import logging
+import sys
+
+from cache import StateCache
+from config import get_config
+from db import Database
+from fetch import Fetcher, RKI_HISTORY_URL, WEATHER_HISTORY_URL
+from retention import RetentionManager
+from tenants import create_database, targets
+
+
+def split_range(start: datetime.datetime, end: datetime.datetime, chunk_days: int) -> list:
+    """ Split [start, end) into consecutive (chunk_start, chunk_end) tuples of chunk_days """
+
+    chunks = []
+    chunk_start = start
+    while chunk_start < end:
+        chunk_end = min(chunk_start + datetime.timedelta(days=chunk_days), end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+
+    return chunks
+
+
+class Backfiller:
+    """ Runs backfill jobs (one per source, location and chunk) on a thread pool """
+
+    def __init__(self, config: dict, fetcher: Fetcher, database: Database, checkpoint: StateCache,
+                 workers: int = 4, rki_url: str = RKI_HISTORY_URL, weather_url: str = WEATHER_HISTORY_URL):
+        self.config = config
+        self.fetcher = fetcher
+        self.database = database
+        self.checkpoint = checkpoint
+        self.workers = workers
+        self.rki_url = rki_url
+        self.weather_url = weather_url
+
+    def jobs(self, chunks: list, rki: bool = True, weather: bool = True) -> list:
+        """ All (key, source, location, start, end) jobs for the chunks, without already finished ones """
+
+        jobs = []
+        for start, end in chunks:
+            span = f"{start:%Y%m%dT%H%M}-{end:%Y%m%dT%H%M}"
+            if rki:
+                jobs.append((f"rki:{span}", 'rki', None, start, end))
+            if weather:
+                for location in self.config['locations']:
+                    jobs.append((f"weather:{location['name']}:{span}", 'weather', location, start, end))
+
+        return [job for job in jobs if not self.checkpoint.get(job[0])]
+
+    def run_job(self, job: tuple) -> int:
+        """ Download one chunk and queue its points, returns the number of points """
+
+        _, source, location, start, end = job
+        count = 0
+        if source == 'rki':
+            for datapoints in self.fetcher.iter_datapoints_rki_history(start, end, self.rki_url):
+                self.database.save_to_database(datapoints, False)
+                count += len(datapoints)
+        else:
+            datapoints = self.fetcher.prepare_datapoints_weather_history(location, start, end, self.weather_url)
+            if datapoints:
+                self.database.save_to_database(datapoints, False)
+            count = len(datapoints)
+
+        return count
+
+    def _commit(self, keys: list):
+        """ Mark jobs as done once their points are written to the database """
+
+        if not keys:
+            return
+        if not self.database.flush(timeout=300):
+            raise RuntimeError("Could not write backfilled points to the database")
+        self.checkpoint.update(**{key: True for key in keys})
+        keys.clear()
+
+    def run(self, jobs: list) -> bool:
+        """ Run all jobs, returns False if at least one of them failed """
+
+        logging.info(f"Backfilling {len(jobs)} chunks with {self.workers} workers")
+        finished = []
+        failed = 0
+        total = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = {executor.submit(self.run_job, job): job for job in jobs}
+            for future in as_completed(futures):
+                key = futures[future][0]
+                try:
+                    count = future.result()
+                except Exception as err:
+                    logging.error(f"Backfill of {key} failed: {err}")
+                    failed += 1
+                    continue
+                total += count
+                finished.append(key)
+                logging.info(f"Backfilled {key}: {count} points")
+                if len(finished) >= self.workers * 4:
+                    self._commit(finished)
+        self._commit(finished)
+        logging.info(f"Backfill done: {total} points, {failed} chunks failed")
+
+        return failed == 0
+
+
+def parse_date(value: str) -> datetime.datetime:
+    return datetime.datetime.strptime(value, '%Y-%m-%d')
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s %(message)s',
+        datefmt='[%Y-%m-%d %H:%M:%S]',
+        level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Backfill historical RKI and weather data into influxdb")
+    parser.add_argument('--start', type=parse_date, required=True, help="first day (YYYY-MM-DD, UTC)")
+    parser.add_argument('--end', type=parse_date, required=True, help="day after the last day (YYYY-MM-DD, UTC)")
+    parser.add_argument('--chunk-days', type=int, default=7, help="days per download chunk")
+    parser.add_argument('--workers', type=int, default=4, help="parallel downloads")
+    parser.add_argument('--checkpoint', default='backfill-checkpoint.json', help="file with finished chunks")
+    parser.add_argument('--no-rki', action='store_true', help="skip RKI case data")
+    parser.add_argument('--no-weather', action='store_true', help="skip weather data")
+    parser.add_argument('--rki-url', default=RKI_HISTORY_URL, help="RKI history FeatureServer query url")
+    parser.add_argument('--weather-url', default=WEATHER_HISTORY_URL, help="openweathermap history url")
+    parser.add_argument('--rollups', action='store_true', help="compute the rollups of the range afterwards")
+    args = parser.parse_args()
+
+    config = get_config()
+    database = create_database(config)
+    fetcher = Fetcher(1, config)
+    backfiller = Backfiller(config, fetcher, database, StateCache(args.checkpoint),
+                            args.workers, args.rki_url, args.weather_url)
+    chunks = split_range(args.start, args.end, args.chunk_days)
+    try:
+        success = backfiller.run(backfiller.jobs(chunks, rki=not args.no_rki, weather=not args.no_weather))
+        if success and args.rollups:
+            for target, target_config in targets(config, database):
+                RetentionManager(target, target_config).backfill(args.start, args.end)
+    finally:
+        fetcher.close()
+        database.close()
+    sys.exit(0 if success else 1)
+
+
+if __name__ == '__main__':
+    main()
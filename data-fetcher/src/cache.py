@@ -0,0 +1,51 @@
+import json
+import logging
+import os
+from threading import Lock
+
+
+class StateCache:
+    """ Small key/value store kept in memory and mirrored to a JSON file
+
+        Used to remember what was last seen upstream (RKI status date, ObjectId,
+        ETag/Last-Modified headers) across ticks and restarts, so unchanged data
+        is neither fetched again nor looked up in influxdb.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = Lock()
+        self.values = self._load()
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, 'r') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as err:
+            logging.warning(f"Ignoring unreadable cache file '{self.path}': {err}")
+            return {}
+
+    def _save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump(self.values, file)
+        os.replace(tmp_path, self.path)
+
+    def get(self, key: str, default=None):
+        with self.lock:
+            return self.values.get(key, default)
+
+    def update(self, **values):
+        """ Set several keys at once, only writes the file if something changed """
+
+        with self.lock:
+            changed = {key: value for key, value in values.items() if self.values.get(key) != value}
+            if not changed:
+                return
+            self.values.update(changed)
+            try:
+                self._save()
+            except OSError as err:
+                logging.warning(f"Could not write cache file '{self.path}': {err}")
@@ -1,9 +1,98 @@
 """module to load the config"""
+import json
 import os
 from dotenv import load_dotenv
 
 pwd = os.path.dirname(os.path.abspath(__file__))
 CONFIG_SAVE_PATH = '{}/../config.json'.format(pwd)
+CACHE_SAVE_PATH = '{}/../cache.json'.format(pwd)
+ALERT_STATE_SAVE_PATH = '{}/../alerts.sqlite'.format(pwd)
+DEDUP_STATE_SAVE_PATH = '{}/../dedup.sqlite'.format(pwd)
+WAL_SAVE_DIR = '{}/../wal'.format(pwd)
+# Fields kept in the ring buffer of recent readings, the ones the notifier rules check
+DEFAULT_RING_BUFFER_FIELDS = 'temperatur,Inz7T'
+
+# Sources polled when SOURCES is not set, see sources.SOURCES for all of them
+DEFAULT_SOURCES = 'weather,rki_status,rki_key_data'
+
+# Location used when LOCATIONS is not set (Bochum)
+DEFAULT_LOCATIONS = "Bochum:51.474810:7.120350"
+
+
+def parse_locations(value: str) -> list:
+    """ Parse 'name:lat:lon;name:lat:lon' into a list of location dicts """
+
+    locations = []
+    for entry in value.split(';'):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, latitude, longitude = entry.rsplit(':', 2)
+        locations.append({
+            "name": name.strip(),
+            "lat": float(latitude),
+            "lon": float(longitude)
+            })
+
+    return locations
+
+
+def optional_float(value: str):
+    """ float of an optional setting, None if it is not set """
+
+    return float(value) if value not in (None, '') else None
+
+
+def parse_deadbands(value: str) -> dict:
+    """ Parse 'field:deadband,field:deadband' into a dict of floats """
+
+    deadbands = {}
+    for entry in value.split(','):
+        if entry.strip():
+            field, deadband = entry.rsplit(':', 1)
+            deadbands[field.strip()] = float(deadband)
+
+    return deadbands
+
+
+def load_profiles(path: str, config: dict) -> list:
+    """ Read the profiles of a JSON file as {"profiles": [{"name", "influxdb", "locations", "api_key"}]}
+
+        Every profile has its own influxdb target, settings it leaves out are taken from the
+        environment. The locations of all profiles become the fetched locations, a location
+        in several profiles is requested once, with the api key of the first of them. Points
+        are told apart by the name of their location, so profiles must not use one name for
+        different coordinates.
+    """
+
+    with open(path, 'r') as file:
+        entries = json.load(file)['profiles']
+
+    profiles = []
+    locations = {}
+    # location name -> name of the first profile listing it
+    owners = {}
+    for entry in entries:
+        influxdb = dict(config['influxdb'], **entry.get('influxdb', {}))
+        api_key = entry.get('api_key', config['openweatherapi']['api_key'])
+        own = entry.get('locations')
+        own = parse_locations(own) if isinstance(own, str) else own or config['locations']
+        for location in own:
+            known = locations.get(location['name'])
+            if known is None:
+                locations[location['name']] = dict(location, api_key=api_key)
+                owners[location['name']] = entry['name']
+            elif (known['lat'], known['lon']) != (location['lat'], location['lon']):
+                raise RuntimeError(f"Location '{location['name']}' of profile '{entry['name']}' has other coordinates "
+                                   f"than in profile '{owners[location['name']]}'")
+        profiles.append({"name": entry['name'], "influxdb": influxdb, "locations": [location['name'] for location in own]})
+
+    config['locations'] = list(locations.values())
+    # points are fetched with the table names of the environment, or else of the first profile
+    for key in ('table_weather', 'table_rki'):
+        config['influxdb'][key] = config['influxdb'][key] or profiles[0]['influxdb'][key]
+
+    return profiles
 
 
 def get_config() -> dict:
@@ -11,11 +100,72 @@ def get_config() -> dict:
     load_dotenv()
     config = {
         "general": {
-            "sampling_time": int(os.getenv("SAMPLING_TIME"))
+            "sampling_time": int(os.getenv("SAMPLING_TIME")),
+            "max_concurrent_requests": int(os.getenv("MAX_CONCURRENT_REQUESTS", "20")),
+            "requests_per_second": float(os.getenv("REQUESTS_PER_SECOND", "10")),
+            "requests_per_key": float(os.getenv("API_KEY_RATE", "0")),
+            "cache_path": os.getenv("CACHE_PATH", CACHE_SAVE_PATH),
+            "metrics_port": int(os.getenv("METRICS_PORT", "0")),
+            "sources": [name.strip() for name in os.getenv("SOURCES", DEFAULT_SOURCES).split(',') if name.strip()],
+            "fetch_workers": int(os.getenv("FETCH_WORKERS", "4")),
+            "fetch_deadline": float(os.getenv("FETCH_DEADLINE", "120")),
+            "connect_timeout": float(os.getenv("HTTP_CONNECT_TIMEOUT", "5")),
+            "read_timeout": float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+            "adaptive": os.getenv("ADAPTIVE_SCHEDULING", "true").lower() in ("1", "true", "yes"),
+            "poll_margin": float(os.getenv("POLL_MARGIN", "30")),
+            "max_backoff": float(os.getenv("MAX_BACKOFF", "3600")),
+            "ring_path": os.getenv("RING_BUFFER_PATH", ""),
+            "ring_size": int(os.getenv("RING_BUFFER_SIZE", "100000")),
+            "ring_fields": [field for field in os.getenv("RING_BUFFER_FIELDS", DEFAULT_RING_BUFFER_FIELDS).split(',')
+                            if field],
+            "notify_in_process": os.getenv("NOTIFIER_IN_PROCESS", "false").lower() in ("1", "true", "yes")
            },
         "openweatherapi": {
             "api_key": os.getenv("API_KEY")
             },
+        "rki": {
+            "bulk": os.getenv("RKI_BULK", "false").lower() in ("1", "true", "yes"),
+            "page_size": int(os.getenv("RKI_PAGE_SIZE", "1000")),
+            "stream": os.getenv("RKI_STREAM_JSON", "true").lower() in ("1", "true", "yes")
+            },
+        "mail": {
+            "mail_user": os.getenv("MAIL_USER"),
+            "mail_password": os.getenv("MAIL_PASSWORD"),
+            "mail_host": os.getenv("MAIL_HOST"),
+            "mail_port": os.getenv("MAIL_PORT"),
+            "mail_recipient": os.getenv("MAIL_RECIPIENT"),
+            "starttls": os.getenv("MAIL_STARTTLS", "true").lower() in ("1", "true", "yes"),
+            "idle_timeout": float(os.getenv("MAIL_IDLE_TIMEOUT", "60")),
+            "digest_window": float(os.getenv("MAIL_DIGEST_WINDOW", "0"))
+            },
+        "notifier": {
+            "max_age_hours": float(os.getenv("DB_MAX_AGE_HOURS", "1")),
+            "age_check_interval": float(os.getenv("DB_AGE_CHECK_INTERVAL", "1800")),
+            "low_temp_threshold": optional_float(os.getenv("LOW_TEMP_THRESHOLD")),
+            "high_temp_threshold": optional_float(os.getenv("HIGH_TEMP_THRESHOLD")),
+            "incidence_threshold": optional_float(os.getenv("INCIDENCE_THRESHOLD")),
+            "temp_window": os.getenv("TEMP_SMOOTHING_WINDOW") or None,
+            "lookback": os.getenv("NOTIFIER_LOOKBACK", "7d"),
+            "state_path": os.getenv("ALERT_STATE_PATH", ALERT_STATE_SAVE_PATH),
+            "temp_hysteresis": float(os.getenv("TEMP_HYSTERESIS", "1")),
+            "incidence_hysteresis": float(os.getenv("INCIDENCE_HYSTERESIS", "5")),
+            "alert_cooldown": float(os.getenv("ALERT_COOLDOWN", "3600")),
+            "alert_dedup_window": float(os.getenv("ALERT_DEDUP_WINDOW", "3600")),
+            "age_alert_cooldown": float(os.getenv("DB_AGE_ALERT_COOLDOWN", "21600"))
+            },
+        "dedup": {
+            "enabled": os.getenv("WRITE_DEDUP", "true").lower() in ("1", "true", "yes"),
+            "state_path": os.getenv("DEDUP_STATE_PATH", DEDUP_STATE_SAVE_PATH),
+            "deadbands": parse_deadbands(os.getenv("WRITE_DEADBANDS", "")),
+            "heartbeat": float(os.getenv("WRITE_HEARTBEAT", "1800"))
+            },
+        "retention": {
+            "enabled": os.getenv("ROLLUPS", "false").lower() in ("1", "true", "yes"),
+            "raw": os.getenv("RAW_RETENTION", ""),
+            "hourly": os.getenv("ROLLUP_HOURLY_RETENTION", "365d"),
+            "daily": os.getenv("ROLLUP_DAILY_RETENTION", "INF")
+            },
+        "locations": parse_locations(os.getenv("LOCATIONS", DEFAULT_LOCATIONS)),
         "influxdb": {
             "username": os.getenv("DB_USERNAME"),
             "password": os.getenv("DB_PASSWORD"),
@@ -23,8 +173,17 @@ def get_config() -> dict:
             "dbname": os.getenv("DB_NAME"),
             "port": os.getenv("DB_PORT"),
             "table_weather": os.getenv("DB_TABLE_WEATHER"),
-            "table_rki": os.getenv("DB_TABLE_RKI")
-            }
+            "table_rki": os.getenv("DB_TABLE_RKI"),
+            "batch_size": int(os.getenv("WRITE_BATCH_SIZE", "5000")),
+            "flush_interval": float(os.getenv("WRITE_FLUSH_INTERVAL", "10")),
+            "buffer_size": int(os.getenv("WRITE_BUFFER_SIZE", "50000")),
+            "wal_path": os.getenv("WAL_DIR", WAL_SAVE_DIR),
+            "wal_max_points": int(os.getenv("WAL_MAX_POINTS", "2000000"))
+            },
+        "profiles": []
         }
 
+    if os.getenv("PROFILES_PATH"):
+        config['profiles'] = load_profiles(os.getenv("PROFILES_PATH"), config)
+
     return config
@@ -1,12 +1,24 @@
 import logging
+import os
+from threading import Lock
 
-from influxdb import InfluxDBClient
+from metrics import DB_QUERY, DB_WRITE
+from wal import WriteAheadLog
+from writer import WriteBuffer
+
+# write-ahead logs per influxdb target, one for each process writing to it at the same time
+WAL_SLOTS = 8
 
 class Database:
-    """Class representing the influxdb database"""
+    """Class representing the influxdb database
+
+    The client (and its pooled HTTP session) is created on first use and kept for the
+    lifetime of the Database. After a failed request it is dropped and recreated lazily.
+    influxdb (and requests) are only imported then, which keeps the start of a process cheap.
+    """
 
     def __init__(self, credentials: dict):
-        """Init for the Database, establishes connection to postgres"""
+        """Init for the Database, connects to influxdb and starts the write buffer on first use"""
 
         self.host = credentials['host']
         self.user = credentials['username']
@@ -15,21 +27,109 @@ class Database:
         self.port = credentials['port']
         self.table_rki = credentials['table_rki']
         self.table_weather = credentials['table_weather']
-        self.client = InfluxDBClient(self.host, self.port, self.user, self.password, self.database)
+        self.pool_size = credentials.get('pool_size', 4)
+        self.batch_size = credentials.get('batch_size', 5000)
+        self.flush_interval = credentials.get('flush_interval', 10.0)
+        self.buffer_size = credentials.get('buffer_size', 50000)
+        self.wal_path = credentials.get('wal_path')
+        self.wal_max_points = credentials.get('wal_max_points', 2000000)
+        self._client = None
+        self._buffer = None
+        self._lock = Lock()
 
-    def get_last_object_id(self):
-        """ TODO """
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from influxdb import InfluxDBClient
 
-        object_id = self.client.query(f"SELECT * FROM {self.table_rki} ORDER BY DESC LIMIT 1;")
+                logging.info(f"Connecting to influxdb at {self.host}:{self.port}")
+                self._client = InfluxDBClient(
+                    self.host, self.port, self.user, self.password, self.database,
+                    gzip=True, pool_size=self.pool_size, timeout=30)
+            return self._client
 
-        return object_id
-    def save_to_database(self, data: list, be_verbose: bool):
-        """ Store the recorded data in the database """
+    @property
+    def buffer(self):
+        """ Write buffer, its background thread is only started by the first write
+
+            With a wal_path it is a WriteAheadLog in that directory, one file per influxdb target.
+            A process running next to another one writing to the same target, e.g. a backfill
+            next to the fetcher, uses the next free file `<target>.<n>.sqlite`. The points left
+            in such a file are replayed by the next process using it.
+        """
+
+        with self._lock:
+            if self._buffer is None and self.wal_path:
+                os.makedirs(self.wal_path, exist_ok=True)
+                name = os.path.join(self.wal_path, f"{self.host}_{self.port}_{self.database}")
+                for slot in range(WAL_SLOTS):
+                    try:
+                        self._buffer = WriteAheadLog(
+                            self._write_lines,
+                            f"{name}.sqlite" if slot == 0 else f"{name}.{slot}.sqlite",
+                            batch_size=self.batch_size,
+                            flush_interval=self.flush_interval,
+                            max_points=self.wal_max_points)
+                        break
+                    except RuntimeError as err:
+                        logging.info(f"{err}, trying the next one")
+                else:
+                    raise RuntimeError(f"All {WAL_SLOTS} write-ahead logs of '{name}' are used by other processes")
+            elif self._buffer is None:
+                self._buffer = WriteBuffer(
+                    self._write_lines,
+                    batch_size=self.batch_size,
+                    flush_interval=self.flush_interval,
+                    max_points=self.buffer_size)
+            return self._buffer
+
+    def reset(self):
+        """ Drop the current client, the next request reconnects """
+
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+
+    def query(self, statement: str, **kwargs):
+        from requests.exceptions import RequestException
+
+        try:
+            with DB_QUERY.time():
+                return self.client.query(statement, **kwargs)
+        except RequestException:
+            self.reset()
+            raise
+
+    def _write_lines(self, lines: str):
+        from requests.exceptions import RequestException
 
         try:
-            bResult = self.client.write_points(data)
-            if be_verbose:
-                print("Write points {0} Bresult:{1}".format(data,bResult))
-            logging.info(f"Saved data in database '{self.database}' successfully!")
-        except (InfluxDBClientError, InfluxDBServerError) as err:
-            raise RuntimeError(err)
+            with DB_WRITE.time():
+                self.client.write_points(lines, protocol='line')
+        except RequestException:
+            self.reset()
+            raise
+
+    def save_to_database(self, data: list, be_verbose: bool):
+        """ Queue the recorded data for the next batched write to the database """
+
+        self.buffer.add(data)
+        if be_verbose:
+            print("Queued points {0}".format(data))
+        logging.info(f"Queued {len(data)} points for database '{self.database}'")
+
+    def flush(self, timeout: float = None) -> bool:
+        """ Write all queued points to the database now """
+
+        if self._buffer is None:
+            return True
+        return self._buffer.flush(timeout)
+
+    def close(self):
+        """ Write remaining points, stop the write buffer and close the connection """
+
+        if self._buffer is not None:
+            self._buffer.close()
+        self.reset()
@@ -0,0 +1,125 @@
+""" JSON decoding of API responses
+
+    loads() parses a response body straight from bytes, with orjson when it is installed
+    and the json module otherwise. FeatureStream parses an ArcGIS query response
+    incrementally from chunks of bytes and yields `features[*].attributes` one at a time,
+    so neither the whole body nor the whole dict tree is held in memory.
+"""
+import codecs
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+CHUNK_SIZE = 64 * 1024
+
+_WHITESPACE = ' \t\n\r'
+_decoder = json.JSONDecoder()
+
+
+def loads(data):
+    """ Decode a JSON document from bytes (or str) """
+
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class FeatureStream:
+    """ Incremental parser for an ArcGIS FeatureServer query response
+
+        Iterating yields the attributes of every feature. All other top level members
+        (e.g. exceededTransferLimit or error) are collected in `meta`, which is complete
+        once the iteration has finished.
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder('utf-8')()
+        self.text = ''
+        self.pos = 0
+        self.eof = False
+        self.meta = {}
+
+    def _fill(self) -> bool:
+        """ Append the next chunk to the text buffer, False at the end of the input """
+
+        if self.eof:
+            return False
+        # drop what has been parsed already, so the buffer stays at about one chunk
+        if self.pos:
+            self.text = self.text[self.pos:]
+            self.pos = 0
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            self.text += self.decoder.decode(b'', final=True)
+        else:
+            self.text += self.decoder.decode(chunk)
+        return True
+
+    def _peek(self) -> str:
+        """ Next character that is not whitespace, without consuming it """
+
+        while True:
+            while self.pos < len(self.text) and self.text[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.text):
+                return self.text[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of JSON response")
+
+    def _expect(self, characters: str) -> str:
+        character = self._peek()
+        if character not in characters:
+            raise ValueError(f"Expected one of {characters!r} at {character!r} in JSON response")
+        self.pos += 1
+        return character
+
+    def _value(self):
+        """ Decode the next complete JSON value, reading more chunks until it is complete """
+
+        self._peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.text, self.pos)
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end == len(self.text) and not self.eof and not isinstance(value, (dict, list, str)):
+                self._fill()
+                continue
+            self.pos = end
+            return value
+
+    def __iter__(self):
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        while True:
+            key = self._value()
+            self._expect(':')
+            if key == 'features' and self._peek() == '[':
+                self.pos += 1
+                if self._peek() == ']':
+                    self.pos += 1
+                else:
+                    while True:
+                        feature = self._value()
+                        yield feature.get('attributes', {})
+                        if self._expect(',]') == ']':
+                            break
+            else:
+                self.meta[key] = self._value()
+            if self._expect(',}') == '}':
+                return
+
+
+def iter_features(response, chunk_size: int = CHUNK_SIZE) -> FeatureStream:
+    """ FeatureStream over the body of a streamed requests response """
+
+    return FeatureStream(response.iter_content(chunk_size))
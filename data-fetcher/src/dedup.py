@@ -0,0 +1,93 @@
+import hashlib
+import json
+import logging
+import sqlite3
+from threading import Lock
+
+from metrics import POINTS_DROPPED
+
+
+class ChangeFilter:
+    """ Drops points that do not differ from the last point written for their series
+
+        Fields with a deadband (e.g. {'temperatur': 0.1}) count as changed once they moved
+        further than that from the last written value, all other fields are compared exactly
+        through a hash. A point is always written once `heartbeat` seconds have passed since
+        the last write of its series. The last write per series is cached in memory and
+        persisted in a small SQLite file, so restarts do not write everything again.
+    """
+
+    def __init__(self, path: str = ':memory:', deadbands: dict = None, heartbeat: float = 1800):
+        self.deadbands = deadbands or {}
+        self.heartbeat = int(heartbeat * 1e9)
+        self.schemas = {}
+        self.lock = Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS written_series ("
+            "series TEXT PRIMARY KEY, time INTEGER NOT NULL, digest TEXT NOT NULL, banded TEXT NOT NULL)")
+        self.connection.commit()
+        self.series = {}
+        for series, timestamp, digest, banded in self.connection.execute(
+                "SELECT series, time, digest, banded FROM written_series"):
+            self.series[series] = (timestamp, digest, tuple(json.loads(banded)))
+        logging.info(f"Loaded last writes of {len(self.series)} series from '{path}'")
+
+    def _split(self, schema) -> tuple:
+        """ Indexes of the exactly compared fields, of the deadband fields and their deadbands """
+
+        split = self.schemas.get(schema)
+        if split is None:
+            banded = [index for index, key in enumerate(schema.field_keys) if key in self.deadbands]
+            exact = [index for index in range(len(schema.field_keys)) if index not in banded]
+            split = self.schemas[schema] = (exact, banded, [self.deadbands[schema.field_keys[index]] for index in banded])
+        return split
+
+    @staticmethod
+    def _within(known: tuple, values: tuple, deadbands: list) -> bool:
+        for old, new, deadband in zip(known, values, deadbands):
+            if old is None or new is None:
+                if old is not new:
+                    return False
+            elif abs(new - old) > deadband:
+                return False
+        return True
+
+    def filter(self, datapoints: list) -> list:
+        """ Points that have to be written, remembers them as the last write of their series """
+
+        kept = []
+        written = []
+        with self.lock:
+            for point in datapoints:
+                exact, banded, deadbands = self._split(point.schema)
+                values = point.field_values
+                series = point.measurement + ''.join(
+                    f',{key}={value}' for key, value in sorted(zip(point.schema.tag_keys, point.tag_values)))
+                digest = hashlib.blake2b(repr([values[index] for index in exact]).encode(), digest_size=8).hexdigest()
+                banded_values = tuple(values[index] for index in banded)
+
+                known = self.series.get(series)
+                if known is not None and point.time - known[0] < self.heartbeat and known[1] == digest \
+                        and self._within(known[2], banded_values, deadbands):
+                    continue
+                kept.append(point)
+                self.series[series] = (point.time, digest, banded_values)
+                written.append((series, point.time, digest, json.dumps(banded_values)))
+
+            if written:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO written_series (series, time, digest, banded) VALUES (?, ?, ?, ?)",
+                    written)
+                self.connection.commit()
+
+        dropped = len(datapoints) - len(kept)
+        if dropped:
+            POINTS_DROPPED.inc(dropped)
+            logging.info(f"Dropped {dropped} of {len(datapoints)} points without change")
+
+        return kept
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
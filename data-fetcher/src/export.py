@@ -0,0 +1,205 @@
+""" Export stored weather and RKI series to partitioned Parquet (or Arrow) files
+
+    Measurements are read from influxdb one chunk of days at a time with chunked queries
+    and written as record batches, so memory stays bounded however long the exported range
+    is. Files are partitioned by month and named after the range they hold:
+
+        export/<measurement>/month=2021-03/<measurement>_20210301T0000-20210401T0000.parquet
+
+    The end of the exported range is recorded per measurement in a state file next to the
+    files, so a later run only exports what was stored since then. Only complete days are
+    exported. Needs pyarrow (pip3 install pyarrow):
+
+        python3 src/export.py --start 2021-01-01
+        python3 src/export.py
+"""
+import argparse
+import datetime
+import logging
+import os
+import sys
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from backfill import parse_date, split_range
+from cache import StateCache
+from config import get_config
+from db import Database
+from query import QueryLayer, quote_ident, select_range
+
+FORMATS = ('parquet', 'arrow')
+
+
+def split_months(start: datetime.datetime, end: datetime.datetime) -> list:
+    """ Split [start, end) into (chunk_start, chunk_end) tuples at the first of every month """
+
+    chunks = []
+    chunk_start = start
+    while chunk_start < end:
+        month = chunk_start.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        chunk_end = min((month + datetime.timedelta(days=32)).replace(day=1), end)
+        chunks.append((chunk_start, chunk_end))
+        chunk_start = chunk_end
+
+    return chunks
+
+
+def arrow_type(field_type: str):
+    """ Arrow type of an influxdb field type (SHOW FIELD KEYS) """
+
+    return {'float': pa.float64(), 'integer': pa.int64(), 'boolean': pa.bool_()}.get(field_type, pa.string())
+
+
+class Exporter:
+    """ Streams measurements out of influxdb into Parquet or Arrow IPC files """
+
+    def __init__(self, database: Database, out: str, state: StateCache, file_format: str = 'parquet',
+                 chunk_days: int = 1, chunk_size: int = 10000, batch_rows: int = 50000):
+        if pa is None:
+            raise RuntimeError("Exports need pyarrow, install it with 'pip3 install pyarrow'")
+        self.database = database
+        self.queries = QueryLayer(database)
+        self.out = out
+        self.state = state
+        self.file_format = file_format
+        self.chunk_days = chunk_days
+        self.chunk_size = chunk_size
+        self.batch_rows = batch_rows
+
+    def schema(self, measurement: str) -> tuple:
+        """ Arrow schema (time, tags, fields) of a measurement and its tag and field keys """
+
+        name = quote_ident(measurement)
+        tag_keys = [row['tagKey'] for row in self.database.query(f"SHOW TAG KEYS FROM {name}").get_points()]
+        field_types = {}
+        for row in self.database.query(f"SHOW FIELD KEYS FROM {name}").get_points():
+            key, field_type = row['fieldKey'], row['fieldType']
+            # a field written with different types in different shards
+            if field_types.get(key, field_type) != field_type:
+                field_type = 'float' if {field_types[key], field_type} == {'float', 'integer'} else 'string'
+            field_types[key] = field_type
+
+        columns = [pa.field('time', pa.timestamp('ns', tz='UTC'))]
+        # a tag named like a field gets a suffix, influxdb allows both
+        columns += [pa.field(f'{key}_tag' if key in field_types else key, pa.string()) for key in tag_keys]
+        columns += [pa.field(key, arrow_type(field_type)) for key, field_type in field_types.items()]
+
+        return pa.schema(columns), tag_keys, list(field_types)
+
+    def _writer(self, path: str, schema):
+        if self.file_format == 'arrow':
+            return pa.ipc.new_file(path, schema)
+        return pq.ParquetWriter(path, schema, compression='zstd')
+
+    def export_range(self, measurement: str, schema: tuple, start: datetime.datetime,
+                     end: datetime.datetime) -> int:
+        """ Write the points with start <= time < end to one file, returns the number of rows """
+
+        arrow_schema, tag_keys, field_keys = schema
+        directory = os.path.join(self.out, measurement, f"month={start:%Y-%m}")
+        path = os.path.join(directory, f"{measurement}_{start:%Y%m%dT%H%M}-{end:%Y%m%dT%H%M}.{self.file_format}")
+        os.makedirs(directory, exist_ok=True)
+
+        tmp_path = f"{path}.tmp"
+        columns = [[] for _ in arrow_schema]
+        count = 0
+        writer = self._writer(tmp_path, arrow_schema)
+
+        def write():
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [pa.array(values, type=field.type) for values, field in zip(columns, arrow_schema)],
+                schema=arrow_schema))
+            for values in columns:
+                values.clear()
+
+        try:
+            for chunk_start, chunk_end in split_range(start, end, self.chunk_days):
+                statement = select_range(measurement, field_keys, chunk_start, chunk_end)
+                for row in self.queries.stream(statement, self.chunk_size, epoch='ns'):
+                    columns[0].append(row.time)
+                    for index, key in enumerate(tag_keys, 1):
+                        columns[index].append(row.tags.get(key) or None)
+                    for index, key in enumerate(field_keys, 1 + len(tag_keys)):
+                        columns[index].append(row.fields.get(key))
+                    count += 1
+                    if len(columns[0]) >= self.batch_rows:
+                        write()
+            if columns[0]:
+                write()
+        finally:
+            writer.close()
+
+        if count:
+            os.replace(tmp_path, path)
+            logging.info(f"Exported {count} rows of {measurement} to '{path}'")
+        else:
+            os.remove(tmp_path)
+
+        return count
+
+    def run(self, measurements: list, end: datetime.datetime, start: datetime.datetime = None) -> int:
+        """ Export every measurement from start (or where its last export ended) to end
+
+            Returns the number of exported rows.
+        """
+
+        total = 0
+        for measurement in measurements:
+            exported = self.state.get(measurement)
+            begin = start or (datetime.datetime.fromisoformat(exported) if exported else None)
+            if begin is None:
+                raise RuntimeError(f"{measurement} has not been exported before, the first export needs a start")
+            if begin >= end:
+                logging.info(f"Export of {measurement} is up to date until {end:%Y-%m-%d}")
+                continue
+
+            schema = self.schema(measurement)
+            for month_start, month_end in split_months(begin, end):
+                total += self.export_range(measurement, schema, month_start, month_end)
+                # resume after the last complete file when interrupted
+                self.state.update(**{measurement: month_end.isoformat()})
+
+        return total
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s %(message)s',
+        datefmt='[%Y-%m-%d %H:%M:%S]',
+        level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Export weather and RKI data from influxdb to Parquet/Arrow files")
+    parser.add_argument('--out', default='export', help="directory of the exported files")
+    parser.add_argument('--start', type=parse_date,
+                        help="first day (YYYY-MM-DD, UTC), default: end of the last export")
+    parser.add_argument('--end', type=parse_date, help="day after the last day (YYYY-MM-DD, UTC), default: today")
+    parser.add_argument('--format', choices=FORMATS, default='parquet', help="file format")
+    parser.add_argument('--measurement', action='append',
+                        help="measurement to export, may be repeated (default: weather and RKI tables)")
+    parser.add_argument('--chunk-days', type=int, default=1, help="days per influxdb query")
+    parser.add_argument('--batch-rows', type=int, default=50000, help="rows per written record batch")
+    args = parser.parse_args()
+
+    config = get_config()
+    database = Database(config['influxdb'])
+    measurements = args.measurement or [config['influxdb']['table_weather'], config['influxdb']['table_rki']]
+    end = args.end or datetime.datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    try:
+        exporter = Exporter(database, args.out, StateCache(os.path.join(args.out, 'export-state.json')),
+                            args.format, args.chunk_days, batch_rows=args.batch_rows)
+        total = exporter.run(measurements, end, args.start)
+        logging.info(f"Export done: {total} rows")
+    except RuntimeError as err:
+        logging.error(f"Export failed: {err}")
+        sys.exit(1)
+    finally:
+        database.close()
+
+
+if __name__ == '__main__':
+    main()
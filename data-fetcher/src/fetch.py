@@ -1,23 +1,114 @@
 import datetime
-import json
-import requests
+import logging
+
+from decode import iter_features, loads
+from metrics import HTTP_LATENCY, JSON_DECODE
+from points import Schema, now_ns
+from workers import check_cancelled, remaining_time
+
+WEATHER_URL = "http://api.openweathermap.org/data/2.5/weather?"
+FORECAST_URL = "http://api.openweathermap.org/data/2.5/forecast?"
+AIR_QUALITY_URL = "http://api.openweathermap.org/data/2.5/air_pollution?"
+RKI_STATUS_URL = "https://services7.arcgis.com/mOBPykOjAyBO2ZKk/arcgis/rest/services/rki_service_status_v/FeatureServer/0/query?"
+RKI_KEY_DATA_URL = "https://services7.arcgis.com/mOBPykOjAyBO2ZKk/arcgis/rest/services/rki_key_data_v/FeatureServer/0/query?"
+RKI_HISTORY_URL = "https://services7.arcgis.com/mOBPykOjAyBO2ZKk/arcgis/rest/services/rki_history_hubv/FeatureServer/0/query?"
+WEATHER_HISTORY_URL = "https://history.openweathermap.org/data/2.5/history/city?"
+RKI_ADM_UNIT_ID = 5911  # ID für den Kreis Bochum gemäß AdmUnit Tabelle
+
+# Attributes of rki_key_data_v that are stored as fields, AdmUnitId and BundeslandId become tags in bulk mode
+RKI_FIELDS = ['AnzFall', 'AnzTodesfallNeu', 'AnzFall7T', 'AnzGenesen', 'AnzGenesenNeu', 'AnzAktiv',
+              'AnzAktivNeu', 'ObjectId', 'Inz7T', 'AnzFallNeu', 'AnzTodesfall']
+RKI_TAGS = ['AdmUnitId', 'BundeslandId']
+RKI_HISTORY_FIELDS = ['AnzFallNeu', 'AnzFallVortag', 'AnzFallErkrankung', 'AnzFallMeldung', 'KumFall']
+WEATHER_FIELDS = ['wetter', 'temperatur', 'luftdruck', 'luftfeuchte', 'sichtweite', 'wind']
 
 class Fetcher:
-    """ Class representing a data fetcher by making HTTP requests to various APIs """
+    """ Class representing a data fetcher by making HTTP requests to various APIs
+
+        The HTTP sessions are created once and reused for every sampling tick. RKI requests
+        are conditional (ETag/Last-Modified) when a StateCache is given.
+    """
+
+    def __init__(self, runNo: int, config: dict, cache=None):
+        # requests and aiohttp are only imported by processes that fetch, not by the notifier
+        import requests
+        from async_fetch import AsyncFetchEngine
 
-    def __init__(self, runNo: int, config: dict):
         self.runNo = runNo
         self.config = config
+        self.cache = cache
+        # API endpoints, can be overridden via config['urls'] e.g. to point at a local stand-in
+        self.urls = {
+            'weather': WEATHER_URL,
+            'forecast': FORECAST_URL,
+            'air_quality': AIR_QUALITY_URL,
+            'rki_status': RKI_STATUS_URL,
+            'rki_key_data': RKI_KEY_DATA_URL
+        }
+        self.urls.update(config.get('urls', {}))
+        # openweathermap measurement time `dt` of the last stored record per location
+        self.weather_times = {}
+        self.weather_source_time = None
+        # one schema per kind of point, their line protocol snippets are prepared once
+        table_weather = config['influxdb']['table_weather']
+        table_rki = config['influxdb']['table_rki']
+        self.schema_weather = Schema(table_weather, ['runNum', 'location'], WEATHER_FIELDS)
+        self.schema_rki = Schema(table_rki, ['runNum'], RKI_TAGS + RKI_FIELDS)
+        self.schema_rki_bulk = Schema(table_rki, ['runNum'] + RKI_TAGS, RKI_FIELDS)
+        self.schema_rki_history = Schema(table_rki, ['runNum'] + RKI_TAGS, RKI_HISTORY_FIELDS)
+        self.session = requests.Session()
+        # (connect, read) timeout of every request, a hanging API must not block a job forever
+        self.timeout = (config['general']['connect_timeout'], config['general']['read_timeout'])
+        self.engine = AsyncFetchEngine(
+            max_concurrency=config['general']['max_concurrent_requests'],
+            rate_per_host=config['general']['requests_per_second'],
+            timeout=config['general']['read_timeout'],
+            connect_timeout=config['general']['connect_timeout'],
+            rate_per_key=config['general']['requests_per_key'])
+
+    def close(self):
+        """ Release the pooled HTTP sessions """
+
+        self.engine.close()
+        self.session.close()
 
-    def get_time_now(self):
-        timestamp = datetime.datetime.utcnow().isoformat()
+    def _conditional_get(self, name: str, url: str, parameter: dict, derive):
+        """ GET request that sends the ETag/Last-Modified of the last response for `name`
 
-        return timestamp
+            Returns (value, changed): value is derive(result) of a fresh response, or the
+            value cached with the last response if upstream answered 304 Not Modified.
+        """
+
+        validators = self.cache.get(f'http_{name}', {}) if self.cache else {}
+        headers = {}
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
+
+        with HTTP_LATENCY.time(api=name):
+            response = self.session.get(url=url, params=parameter, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and 'value' in validators:
+            logging.info(f"{name}: not modified upstream")
+            return validators['value'], False
+        response.raise_for_status()
+
+        with JSON_DECODE.time(api=name):
+            result = loads(response.content)
+        value = derive(result)
+        if self.cache is not None:
+            self.cache.update(**{f'http_{name}': {
+                'etag': response.headers.get('ETag'),
+                'last_modified': response.headers.get('Last-Modified'),
+                'value': value
+            }})
+
+        return value, True
 
     def check_status_api(self):
-        """ Get response from status api for date check"""
+        """ Get response from status api for date check, returns the date as YYYY-MM-DD"""
 
-        url = "https://services7.arcgis.com/mOBPykOjAyBO2ZKk/arcgis/rest/services/rki_service_status_v/FeatureServer/0/query?"
+        url = self.urls['rki_status']
         parameter = {
             'referer': 'https://www.mywebapp.com',
             'user-agent': 'python-requests/2.9.1',
@@ -27,20 +118,24 @@ class Fetcher:
             'f': 'json',
             'cacheHint': True
         }
-        response = requests.get(url=url, params=parameter)  # Anfrage absetzen
-        responsejson = json.loads(response.text)  # Das Ergebnis JSON als Python Dictionary laden
 
+        def to_date(responsejson):
+            date_unix_time = responsejson['features'][-1]['attributes']['Datum']
+            return datetime.datetime.fromtimestamp(int(date_unix_time / 1000)).strftime('%Y-%m-%d')
 
-        date_unix_time = responsejson['features'][-1]['attributes']['Datum']
-        date = datetime.datetime.fromtimestamp(int(date_unix_time / 1000)).strftime('%Y-%m-%d')
+        # Anfrage absetzen, Ergebnis JSON als Python Dictionary laden
+        date, _ = self._conditional_get('rki_status', url, parameter, to_date)
 
         return date
 
     def get_inzidenz(self):
-        """ Function to retrieve the 7-day incidence value from the RKI API """
+        """ Function to retrieve the 7-day incidence value from the RKI API
 
-        url = "https://services7.arcgis.com/mOBPykOjAyBO2ZKk/arcgis/rest/services/rki_key_data_v/FeatureServer/0/query?"
-        lk_id = 5911  # ID für den Kreis Bochum gemäß AdmUnit Tabelle
+            Returns None if the data has not changed since the last request.
+        """
+
+        url = self.urls['rki_key_data']
+        lk_id = RKI_ADM_UNIT_ID
 
         parameter = {
             'referer': 'https://www.mywebapp.com',
@@ -52,51 +147,168 @@ class Fetcher:
             'cacheHint': True  # Zugriff über CDN anfragen
         }
 
-        response = requests.get(url=url, params=parameter)
-        result = json.loads(response.text)
+        attributes, changed = self._conditional_get(
+            'rki_key_data', url, parameter, lambda result: result['features'][0]['attributes'])
 
-        return result['features'][0]['attributes']
+        return attributes if changed else None
 
-    def get_weather(self):
-        """ Function to retrieve weather data from the openweathermap API """
+    def _iter_pages(self, url: str, parameter: dict, api: str = 'rki'):
+        """ Page through an ArcGIS FeatureServer query with resultOffset/resultRecordCount
 
-        url = "http://api.openweathermap.org/data/2.5/weather?"
-        api_key = self.config['openweatherapi']['api_key']
-        latitude = "51.474810"
-        longitude = "7.120350"
+            Yields one list of attribute dicts per page, so only a single page is held in memory.
+            With config['rki']['stream'] the attributes are decoded while the body is downloaded.
+        """
+
+        page_size = self.config['rki']['page_size']
+        stream = self.config['rki']['stream']
+        offset = 0
+        while True:
+            check_cancelled()
+            page_parameter = dict(parameter, resultOffset=offset, resultRecordCount=page_size)
+            with HTTP_LATENCY.time(api=api):
+                response = self.session.get(url=url, params=page_parameter, timeout=self.timeout, stream=stream)
+            with response:
+                response.raise_for_status()
+                # when streaming this includes reading the body
+                with JSON_DECODE.time(api=api):
+                    if stream:
+                        features = iter_features(response)
+                        attributes = list(features)
+                        result = features.meta
+                    else:
+                        result = loads(response.content)
+                        attributes = [feature['attributes'] for feature in result.get('features', [])]
+            if 'error' in result:
+                raise RuntimeError(f"RKI API error: {result['error']}")
+
+            if attributes:
+                yield attributes
+            offset += len(attributes)
+            if not attributes or not result.get('exceededTransferLimit', len(attributes) == page_size):
+                break
+
+    def iter_inzidenz_bulk(self):
+        """ Page through rki_key_data_v for all districts and federal states
+
+            Only the attributes in RKI_TAGS and RKI_FIELDS are requested.
+        """
 
         parameter = {
-            'lat': f'{latitude}',
-            'lon': f'{longitude}',
-            'appid': f'{api_key}',
-            'lang': 'de'
+            'where': '1=1',
+            'outFields': ','.join(RKI_TAGS + RKI_FIELDS),
+            'orderByFields': 'ObjectId',  # stabile Reihenfolge zum Blättern
+            'returnGeometry': False,
+            'f': 'json',
+            'cacheHint': True
         }
 
-        response = requests.get(url=url, params=parameter)
-        result = json.loads(response.text)
+        return self._iter_pages(self.urls['rki_key_data'], parameter, 'rki_key_data')
 
-        return result
+    @staticmethod
+    def rki_values(rki_daten: dict, fields: list) -> tuple:
+        """ Values of the given RKI attributes in order, the incidence is always stored as float """
 
-    def prepare_datapoints_weather(self):
-        """ Create Influxdb datapoints (using lineprotocol as of Influxdb >1.1) """
+        return tuple(
+            float(rki_daten[field]) if field == 'Inz7T' and rki_daten.get(field) is not None
+            else rki_daten.get(field)
+            for field in fields)
 
-        wetter_daten = self.get_weather()
+    def iter_datapoints_rki_bulk(self):
+        """ Create Influxdb datapoints for every AdmUnitId, one list of points per API page """
 
-        datapoints = [
-            {
-                "measurement": self.config['influxdb']['table_weather'],
-                "tags": {"runNum": self.runNo},
-                "time": self.get_time_now(),
-                "fields": {
-                    "wetter": wetter_daten['weather'][0]['description'],
-                    "temperatur": wetter_daten['main']['temp'] - 273.15,
-                    "luftdruck": wetter_daten['main']['pressure'],
-                    "luftfeuchte": wetter_daten['main']['humidity'],
-                    "sichtweite": wetter_daten['visibility'],
-                    "wind": wetter_daten['wind']['speed']
-                }
-            }
+        schema = self.schema_rki_bulk
+        timestamp = now_ns()
+
+        for page in self.iter_inzidenz_bulk():
+            yield [
+                schema.point(
+                    (self.runNo, rki_daten['AdmUnitId'], rki_daten['BundeslandId']),
+                    timestamp,
+                    self.rki_values(rki_daten, RKI_FIELDS))
+                for rki_daten in page
+            ]
+
+    def get_locations(self, name: str, parameter: dict = None):
+        """ Request the openweathermap endpoint self.urls[name] for all configured locations concurrently
+
+            Returns a list of (location, result) tuples, locations that failed are left out.
+            A location with its own `api_key` (see config.load_profiles) is requested with it.
+        """
+
+        url = self.urls[name]
+        api_key = self.config['openweatherapi']['api_key']
+        locations = self.config['locations']
+
+        requests_locations = [
+            (url, dict({
+                'lat': f"{location['lat']}",
+                'lon': f"{location['lon']}",
+                'appid': f"{location.get('api_key') or api_key}",
+                'lang': 'de'
+            }, **(parameter or {})))
+            for location in locations
         ]
+        # a job given up by the Supervisor stops waiting for its requests at its deadline
+        check_cancelled()
+        responses = self.engine.get_many(requests_locations, timeout=remaining_time(), api=name)
+
+        results = []
+        for location, result in zip(locations, responses):
+            if isinstance(result, Exception):
+                logging.warning(f"Fetching {name} for '{location['name']}' failed: {result!r}")
+                continue
+            results.append((location, result))
+
+        return results
+
+    def get_weather(self):
+        """ Function to retrieve weather data for all configured locations from the openweathermap API
+
+            All locations are requested concurrently, returns a list of (location, result) tuples.
+        """
+
+        return self.get_locations('weather')
+
+    @staticmethod
+    def weather_fields(wetter_daten: dict) -> tuple:
+        """ Field values stored for one openweathermap record (current or historical), see WEATHER_FIELDS """
+
+        return (
+            wetter_daten['weather'][0]['description'],
+            wetter_daten['main']['temp'] - 273.15,
+            wetter_daten['main']['pressure'],
+            wetter_daten['main']['humidity'],
+            wetter_daten.get('visibility'),
+            wetter_daten['wind']['speed']
+        )
+
+    def weather_datapoints(self, results: list):
+        """ Datapoints of the (location, result) tuples of get_weather()
+
+            Returns one batch with a point per location, tagged with the location name. Locations
+            whose measurement time `dt` did not change since the last call are left out,
+            weather_source_time is set to the newest `dt` of all locations.
+        """
+
+        timestamp = now_ns()
+        schema = self.schema_weather
+
+        datapoints = []
+        unchanged = 0
+        for location, wetter_daten in results:
+            measured = wetter_daten.get('dt')
+            if measured is not None:
+                self.weather_source_time = max(self.weather_source_time or 0, measured)
+                if self.weather_times.get(location['name']) == measured:
+                    unchanged += 1
+                    continue
+                self.weather_times[location['name']] = measured
+            datapoints.append(schema.point((self.runNo, location['name']), timestamp, self.weather_fields(wetter_daten)))
+        if unchanged:
+            logging.info(f"Weather unchanged upstream for {unchanged} locations")
+        failed = len(self.config['locations']) - len(results)
+        if failed:
+            logging.warning(f"Weather of {failed} locations could not be fetched")
 
         return datapoints
 
@@ -104,28 +316,80 @@ class Fetcher:
         """ Create Influxdb datapoints (using lineprotocol as of Influxdb >1.1) """
 
         rki_daten = self.get_inzidenz()
+        if rki_daten is None:
+            return []
 
         datapoints = [
-            {
-                "measurement": self.config['influxdb']['table_rki'],
-                "tags": {"runNum": self.runNo},
-                "time": self.get_time_now(),
-                "fields": {
-                    'AdmUnitId': rki_daten['AdmUnitId'],
-                    'BundeslandId': rki_daten['BundeslandId'],
-                    'AnzFall': rki_daten['AnzFall'],
-                    'AnzTodesfallNeu': rki_daten['AnzTodesfallNeu'],
-                    'AnzFall7T': rki_daten['AnzFall7T'],
-                    'AnzGenesen': rki_daten['AnzGenesen'],
-                    'AnzGenesenNeu': rki_daten['AnzGenesenNeu'],
-                    'AnzAktiv': rki_daten['AnzAktiv'],
-                    'AnzAktivNeu': rki_daten['AnzAktivNeu'],
-                    'ObjectId': rki_daten['ObjectId'],
-                    "Inz7T": float(rki_daten['Inz7T']),
-                    "AnzFallNeu": rki_daten['AnzFallNeu'],
-                    "AnzTodesfall": rki_daten['AnzTodesfall']
-                }
-            }
+            self.schema_rki.point(
+                (self.runNo,), now_ns(), self.rki_values(rki_daten, RKI_TAGS + RKI_FIELDS))
         ]
 
         return datapoints
+
+    def get_weather_history(self, location: dict, start: datetime.datetime, end: datetime.datetime,
+                            url: str = WEATHER_HISTORY_URL):
+        """ Function to retrieve hourly historical weather of one location from the openweathermap history API """
+
+        parameter = {
+            'lat': f"{location['lat']}",
+            'lon': f"{location['lon']}",
+            'type': 'hour',
+            'start': int(start.replace(tzinfo=datetime.timezone.utc).timestamp()),
+            'end': int(end.replace(tzinfo=datetime.timezone.utc).timestamp()),
+            'appid': location.get('api_key') or self.config['openweatherapi']['api_key'],
+            'lang': 'de'
+        }
+        with HTTP_LATENCY.time(api='weather_history'):
+            response = self.session.get(url=url, params=parameter, timeout=self.timeout)
+        response.raise_for_status()
+        with JSON_DECODE.time(api='weather_history'):
+            result = loads(response.content)
+
+        return result.get('list', [])
+
+    def prepare_datapoints_weather_history(self, location: dict, start: datetime.datetime,
+                                           end: datetime.datetime, url: str = WEATHER_HISTORY_URL):
+        """ Create Influxdb datapoints for historical weather, timestamped with the measurement time `dt` """
+
+        schema = self.schema_weather
+
+        return [
+            schema.point((self.runNo, location['name']), wetter_daten['dt'] * 10 ** 9,
+                         self.weather_fields(wetter_daten))
+            for wetter_daten in self.get_weather_history(location, start, end, url)
+        ]
+
+    def iter_rki_history(self, start: datetime.datetime, end: datetime.datetime, url: str = RKI_HISTORY_URL):
+        """ Page through the historical RKI case numbers between start and end
+
+            Covers all districts in bulk mode, otherwise only RKI_ADM_UNIT_ID.
+        """
+
+        where = (f"Datum >= timestamp '{start:%Y-%m-%d %H:%M:%S}' "
+                 f"AND Datum < timestamp '{end:%Y-%m-%d %H:%M:%S}'")
+        if not self.config['rki']['bulk']:
+            where += f" AND AdmUnitId = {RKI_ADM_UNIT_ID}"
+        parameter = {
+            'where': where,
+            'outFields': ','.join(RKI_TAGS + ['Datum'] + RKI_HISTORY_FIELDS),
+            'orderByFields': 'Datum,AdmUnitId',
+            'returnGeometry': False,
+            'f': 'json'
+        }
+
+        return self._iter_pages(url, parameter, 'rki_history')
+
+    def iter_datapoints_rki_history(self, start: datetime.datetime, end: datetime.datetime,
+                                    url: str = RKI_HISTORY_URL):
+        """ Create Influxdb datapoints for historical RKI data, timestamped with the report date `Datum` """
+
+        schema = self.schema_rki_history
+
+        for page in self.iter_rki_history(start, end, url):
+            yield [
+                schema.point(
+                    (self.runNo, rki_daten['AdmUnitId'], rki_daten['BundeslandId']),
+                    int(rki_daten['Datum']) * 10 ** 6,
+                    self.rki_values(rki_daten, RKI_HISTORY_FIELDS))
+                for rki_daten in page
+            ]
@@ -0,0 +1,190 @@
+""" Mail delivery of the notifier
+
+    email.mime and smtplib are only imported once the first mail is built or sent, most
+    processes run for long stretches without sending any.
+"""
+from functools import lru_cache
+import base64
+import logging
+from pathlib import Path
+import queue
+from threading import Thread
+import time
+
+from metrics import MAIL_SEND, RETRIES
+
+
+@lru_cache(maxsize=16)
+def encoded_attachment(path: str) -> str:
+    """ Base64 encoded content of a file, read and encoded only once per path """
+
+    with open(path, 'rb') as file:
+        return base64.encodebytes(file.read()).decode('ascii')
+
+
+def build_message(sender: str, recipient: str, subject: str, body: str, attachments: list = ()):
+    """ Create a mail with a plain text body and the given files (e.g. gifs) attached """
+
+    from email.mime.base import MIMEBase
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    msg = MIMEMultipart()
+    msg['Subject'] = subject
+    msg['From'] = sender
+    msg['To'] = recipient
+    msg.attach(MIMEText(body, 'plain'))
+
+    for attachment in attachments:
+        part = MIMEBase('application', "octet-stream")
+        part.set_payload(encoded_attachment(attachment))
+        part['Content-Transfer-Encoding'] = 'base64'
+        part.add_header('Content-Disposition',
+                        'attachment; filename={}'.format(Path(attachment).name))
+        msg.attach(part)
+
+    return msg
+
+
+class MailDispatcher:
+    """ Delivers mails from a background thread over one reused SMTP connection
+
+        submit() only queues a mail. The connection is kept open between mails and
+        reopened when it was idle for longer than idle_timeout or the server dropped it.
+        With a digest_window all mails submitted within that many seconds are folded
+        into a single mail. A mail that cannot be delivered after all retries calls its
+        on_failure callback (from the dispatcher thread).
+    """
+
+    def __init__(self, config: dict, digest_window: float = 0, idle_timeout: float = 60,
+                 starttls: bool = True, retries: int = 3):
+        self.config = config
+        self.digest_window = digest_window
+        self.idle_timeout = idle_timeout
+        self.starttls = starttls
+        self.retries = retries
+        self.queue = queue.Queue()
+        self.server = None
+        self.last_used = 0
+        self.thread = Thread(target=self._run, name='mail-dispatcher', daemon=True)
+        self.thread.start()
+
+    def submit(self, subject: str, body: str, attachment: str = None, on_failure=None):
+        """ Queue a mail for delivery, on_failure() is called if it cannot be delivered """
+
+        self.queue.put((subject, body, attachment, on_failure))
+
+    def close(self, timeout: float = 30):
+        """ Deliver queued mails, then stop the thread and close the connection """
+
+        self.queue.put(None)
+        self.thread.join(timeout)
+
+    def _connect(self):
+        import smtplib
+
+        server = smtplib.SMTP(self.config["mail_host"], self.config["mail_port"], timeout=30)
+        # server.set_debuglevel(1)
+        if self.starttls:
+            server.starttls()
+        if self.config["mail_password"]:
+            server.login(self.config["mail_user"], self.config["mail_password"])
+        return server
+
+    def _disconnect(self):
+        from smtplib import SMTPException
+
+        if self.server is not None:
+            try:
+                self.server.quit()
+            except (SMTPException, OSError):
+                pass
+            self.server = None
+
+    def _deliver(self, msg):
+        from smtplib import SMTPException
+
+        sender = self.config["mail_user"]
+        recipient = self.config["mail_recipient"]
+        for attempt in range(1, self.retries + 1):
+            if self.server is not None and time.monotonic() - self.last_used > self.idle_timeout:
+                self._disconnect()
+            try:
+                with MAIL_SEND.time():
+                    if self.server is None:
+                        self.server = self._connect()
+                    self.server.sendmail(sender, recipient, msg.as_string())
+                self.last_used = time.monotonic()
+                logging.info(f"Successfully sent email to {recipient}!")
+                return True
+            except (SMTPException, OSError) as err:
+                logging.warning(f"Sending email failed (attempt {attempt}/{self.retries}): {err}")
+                RETRIES.inc(component='mail')
+                self._disconnect()
+                time.sleep(min(2 ** attempt, 30))
+        logging.error(f"ERROR: unable to send email '{msg['Subject']}'")
+
+        return False
+
+    def _collect(self, first: tuple) -> tuple:
+        """ Gather all mails arriving within the digest window, returns (mails, stop) """
+
+        mails = [first]
+        deadline = time.monotonic() + self.digest_window
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return mails, False
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                return mails, False
+            if item is None:
+                return mails, True
+            mails.append(item)
+
+    def _digest(self, mails: list):
+        if len(mails) == 1:
+            subject, body, attachment, _ = mails[0]
+            return subject, body, [attachment] if attachment else []
+
+        subject = f"{len(mails)} Notifications: " + ", ".join(dict.fromkeys(mail[0] for mail in mails))
+        body = "\n".join(f"{mail_subject}\n{mail_body}" for mail_subject, mail_body, _, _ in mails)
+        attachments = list(dict.fromkeys(mail[2] for mail in mails if mail[2]))
+
+        return subject, body, attachments
+
+    @staticmethod
+    def _failed(mails: list):
+        for *_, on_failure in mails:
+            if on_failure is not None:
+                try:
+                    on_failure()
+                except Exception as err:
+                    logging.error(f"Handling an undelivered email failed: {err}")
+
+    def _run(self):
+        stop = False
+        while not stop:
+            try:
+                item = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._disconnect()
+                continue
+            if item is None:
+                break
+
+            mails = [item]
+            if self.digest_window > 0:
+                mails, stop = self._collect(item)
+            subject, body, attachments = self._digest(mails)
+            try:
+                msg = build_message(self.config["mail_user"], self.config["mail_recipient"],
+                                    subject, body, attachments)
+            except OSError as err:
+                logging.error(f"ERROR: unable to build email '{subject}': {err}")
+                self._failed(mails)
+                continue
+            if not self._deliver(msg):
+                self._failed(mails)
+        self._disconnect()
@@ -0,0 +1,169 @@
+""" Minimal Prometheus-style metrics for the fetcher and the notifier
+
+    Metrics are plain in-process counters and fixed-bucket histograms; recording a value
+    is a dict lookup and a few additions under a lock. start_metrics_server() exposes
+    them in the Prometheus text format on http://<host>:<port>/metrics.
+"""
+import bisect
+import logging
+from threading import Lock, Thread
+import time
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1, 10, 100, 1000, 5000, 10000, 50000)
+
+
+def _format_labels(labels: tuple, extra: tuple = ()) -> str:
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}'
+
+
+class _Timer:
+    def __init__(self, histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, **self.labels)
+
+
+class Counter:
+    """ Monotonic counter per label set """
+
+    kind = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self.lock = Lock()
+        self.values = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list:
+        with self.lock:
+            return [f"{self.name}{_format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram:
+    """ Histogram with fixed buckets per label set """
+
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self.lock = Lock()
+        self.values = {}
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels) -> _Timer:
+        """ Context manager observing the duration of the block """
+
+        return _Timer(self, labels)
+
+    def samples(self) -> list:
+        lines = []
+        with self.lock:
+            for key, (counts, total, count) in self.values.items():
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(key, (('le', bound),))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self) -> str:
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HTTP_LATENCY = REGISTRY.register(Histogram(
+    'wetter_http_request_seconds', 'Latency of upstream API requests by api'))
+JSON_DECODE = REGISTRY.register(Histogram(
+    'wetter_json_decode_seconds', 'Time spent decoding API responses by api'))
+DB_WRITE = REGISTRY.register(Histogram(
+    'wetter_influxdb_write_seconds', 'Latency of influxdb batch writes'))
+DB_QUERY = REGISTRY.register(Histogram(
+    'wetter_influxdb_query_seconds', 'Latency of influxdb queries'))
+BATCH_SIZE = REGISTRY.register(Histogram(
+    'wetter_write_batch_points', 'Number of points per influxdb batch write', SIZE_BUCKETS))
+RETRIES = REGISTRY.register(Counter(
+    'wetter_retries_total', 'Retried operations by component'))
+SCHEDULER_LAG = REGISTRY.register(Histogram(
+    'wetter_scheduler_lag_seconds', 'Delay between the planned and the actual start of a tick'))
+TICK_DURATION = REGISTRY.register(Histogram(
+    'wetter_tick_seconds', 'Duration of a scheduler tick by job'))
+MAIL_SEND = REGISTRY.register(Histogram(
+    'wetter_mail_send_seconds', 'Time to deliver a notification mail'))
+JOB_TIMEOUTS = REGISTRY.register(Counter(
+    'wetter_job_timeouts_total', 'Fetch jobs given up after their deadline by job'))
+POINTS_DROPPED = REGISTRY.register(Counter(
+    'wetter_points_dropped_total', 'Points not written because they did not change'))
+WRITE_POINTS_DROPPED = REGISTRY.register(Counter(
+    'wetter_write_points_dropped_total', 'Queued points never written to influxdb by reason (full, rejected)'))
+
+
+def start_metrics_server(port: int, host: str = '0.0.0.0'):
+    """ Serve REGISTRY on /metrics from a daemon thread """
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path.split('?')[0] != '/metrics':
+                self.send_response(404)
+                self.end_headers()
+                return
+            body = REGISTRY.exposition().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name='metrics-server', daemon=True).start()
+    logging.info(f"Serving metrics on http://{host}:{port}/metrics")
+
+    return server
@@ -0,0 +1,262 @@
+""" Notification service: evaluates all rules (data age, temperature, incidence) in one process
+
+    Runs standalone with one shared influxdb query per tick (python3 src/notifier.py), or
+    inside the data-fetcher, which hands over its freshly fetched points (NOTIFIER_IN_PROCESS).
+    Standalone it reads the ring buffer of recent readings instead of influxdb when one is
+    configured (RING_BUFFER_PATH) and falls back to influxdb while the buffer has no data. The data
+    age is always checked against influxdb itself, the readings are new while it is down.
+"""
+import datetime
+from functools import partial
+import logging
+import sys
+from typing import TYPE_CHECKING
+import time
+
+from alerts import AlertStateStore, should_send
+from config import get_config
+from db import Database
+from mail import MailDispatcher
+from metrics import start_metrics_server
+from query import (QueryLayer, duration_seconds, select_aggregates, select_latest, select_newest,
+                   select_rollup_aggregates)
+from retention import hourly_rollup
+from rules import Snapshot, build_rules
+from scheduler import Scheduler
+from tenants import create_database
+
+if TYPE_CHECKING:
+    # numpy is only imported when a ring buffer is configured
+    from ringbuffer import RingBuffer
+
+# Windows of at least this many seconds are aggregated from the hourly rollups if they exist
+ROLLUP_MIN_WINDOW = 86400
+
+
+class RuleEngine:
+    """ Hosts the notification rules and the snapshot of latest points they are checked against """
+
+    def __init__(self, rules: list, mailer: MailDispatcher, lookback: str = '7d', states: AlertStateStore = None,
+                 ring: 'RingBuffer' = None, rollups: bool = False):
+        self.rules = rules
+        self.mailer = mailer
+        self.lookback = lookback
+        self.states = states or AlertStateStore()
+        self.ring = ring
+        self.rollups = rollups
+        self.snapshot = Snapshot()
+        self.last_run = {rule.name: None for rule in rules}
+        # the last refresh read the newest points from influxdb
+        self.stored_fresh = False
+
+    def observe(self, datapoints: list):
+        """ Hand over points in-process, e.g. right after the fetcher prepared them """
+
+        self.snapshot.observe(datapoints)
+
+    def fields(self) -> dict:
+        """ Fields the rules read, per measurement """
+
+        fields = {}
+        for rule in self.rules:
+            if rule.measurement:
+                fields.setdefault(rule.measurement, set()).update(rule.fields)
+
+        return {measurement: sorted(names) for measurement, names in sorted(fields.items())}
+
+    def statements(self) -> list:
+        """ Projection-only statements for all rules: latest point per measurement, then aggregates """
+
+        statements = [('latest', measurement, select_latest(measurement, names, self.lookback))
+                      for measurement, names in self.fields().items()]
+        for rule in self.rules:
+            if rule.aggregates is not None:
+                field, window = rule.aggregates
+                if self.rollups and duration_seconds(window) >= ROLLUP_MIN_WINDOW:
+                    statement = select_rollup_aggregates(*hourly_rollup(rule.measurement), field, window)
+                else:
+                    statement = select_aggregates(rule.measurement, field, window)
+                statements.append(('aggregates', rule.measurement, statement))
+        statements += [('stored', measurement, statement) for measurement, statement in self.stored_statements()]
+
+        return statements
+
+    def stored_statements(self) -> list:
+        """ (measurement, statement) of the newest point of the measurements checked against influxdb itself """
+
+        fields = {}
+        for rule in self.rules:
+            if rule.from_database:
+                fields.setdefault(rule.measurement, rule.fields[0])
+
+        return [(measurement, select_newest(measurement, field)) for measurement, field in sorted(fields.items())]
+
+    def refresh_from_ring(self) -> bool:
+        """ Load what the rules need from the ring buffer, False if it holds none of it or cannot hold it """
+
+        if not all(self.ring.accepts(measurement, fields) for measurement, fields in self.fields().items()):
+            return False
+        now = time.time_ns()
+        found = False
+        since = now - int(duration_seconds(self.lookback) * 1e9)
+        for measurement, fields in self.fields().items():
+            for tags, timestamp, values in self.ring.latest(measurement, fields, since):
+                self.snapshot.update(measurement, tags, timestamp, values)
+                found = True
+        for rule in self.rules:
+            if rule.aggregates is not None:
+                field, window = rule.aggregates
+                since = now - int(duration_seconds(window) * 1e9)
+                for tags, values in self.ring.aggregates(rule.measurement, field, since):
+                    self.snapshot.update_aggregates(rule.measurement, tags, values)
+
+        return found
+
+    def refresh(self, database: Database):
+        """ Load what the rules need from the ring buffer if it has data, otherwise from influxdb
+            with a single request
+        """
+
+        self.stored_fresh = False
+        if self.ring is not None:
+            try:
+                if self.refresh_from_ring():
+                    return
+            except Exception as err:
+                logging.warning(f"Reading the ring buffer failed, reading influxdb instead: {err}")
+
+        statements = self.statements()
+        results = QueryLayer(database).run([statement for _, _, statement in statements])
+        for (kind, measurement, _), rows in zip(statements, results):
+            for row in rows:
+                if kind == 'latest':
+                    self.snapshot.update(measurement, row.tags, row.time, row.fields)
+                elif kind == 'stored':
+                    self.snapshot.update_stored(measurement, row.time)
+                else:
+                    self.snapshot.update_aggregates(measurement, row.tags, row.fields)
+            if kind == 'stored' and not rows:
+                self.snapshot.update_stored(measurement, None)
+        self.stored_fresh = True
+
+    def refresh_stored(self, database: Database):
+        """ Read the newest points of the measurements checked against influxdb (data age) """
+
+        statements = self.stored_statements()
+        results = QueryLayer(database).run([statement for _, statement in statements])
+        for (measurement, _), rows in zip(statements, results):
+            for row in rows:
+                self.snapshot.update_stored(measurement, row.time)
+            if not rows:
+                self.snapshot.update_stored(measurement, None)
+
+    def _due(self, rule) -> bool:
+        last_run = self.last_run[rule.name]
+        return last_run is None or time.monotonic() - last_run >= rule.interval
+
+    def tick(self, now: datetime.datetime = None, database: Database = None):
+        """ Evaluate all rules that are due and mail alerts according to their alert state
+
+            With a database the rules checking influxdb itself read it first when they are due,
+            unless the last refresh already did.
+        """
+
+        now = now or datetime.datetime.utcnow()
+        if database is not None and not self.stored_fresh and any(rule.from_database and self._due(rule)
+                                                                  for rule in self.rules):
+            try:
+                self.refresh_stored(database)
+            except Exception as err:
+                # the known age keeps growing, so an unreachable influxdb still raises the alert
+                logging.warning(f"Reading the newest points from influxdb failed: {err}")
+        self.stored_fresh = False
+        for rule in self.rules:
+            if not self._due(rule):
+                continue
+            self.last_run[rule.name] = time.monotonic()
+
+            active = self.states.active_keys(rule.name)
+            alerts = rule.evaluate(self.snapshot, now, active)
+            timestamp = time.time()
+            for key, alert in alerts.items():
+                state = self.states.get(rule.name, key)
+                if should_send(rule, state, timestamp):
+                    logging.info(f"Rule '{rule.name}' triggered: {key}")
+                    # an undelivered mail puts back the state before it, so the alert is sent again
+                    previous = self.states.get(rule.name, key)
+                    self.mailer.submit(alert.subject, alert.body, alert.attachment,
+                                       on_failure=partial(self.states.restore, rule.name, key, timestamp, previous))
+                    state.last_sent = timestamp
+                if not state.active:
+                    state.active = True
+                    state.changed = timestamp
+                self.states.put(rule.name, key, state)
+
+            for key in active - set(alerts):
+                logging.info(f"Rule '{rule.name}' cleared: {key}")
+                state = self.states.get(rule.name, key)
+                state.active = False
+                state.changed = timestamp
+                self.states.put(rule.name, key, state)
+
+
+def create_mailer(config: dict) -> MailDispatcher:
+    mail = config['mail']
+    return MailDispatcher(mail, mail['digest_window'], mail['idle_timeout'], mail['starttls'])
+
+
+def check(engine: RuleEngine, database: Database):
+    """ One notifier tick: refresh the snapshot from influxdb and evaluate the rules """
+
+    try:
+        engine.refresh(database)
+    except Exception as err:
+        logging.error(f"Reading latest datapoints failed: {err}")
+    engine.tick(database=database)
+
+
+def main():
+    """Main loop of the notifier, checks all rules once every sampling period"""
+
+    # Set format of log messages
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s %(message)s',
+        datefmt='[%Y-%m-%d %H:%M:%S]',
+        level=logging.INFO)
+
+    config = get_config()
+    rules = build_rules(config)
+    logging.info(f"Notifier rules: {', '.join(rule.name for rule in rules)}")
+
+    if config['general']['metrics_port']:
+        start_metrics_server(config['general']['metrics_port'])
+
+    # with profiles (PROFILES_PATH) the database of the first profile is checked
+    database = create_database(config)
+    states = AlertStateStore(config['notifier']['state_path'])
+    mailer = create_mailer(config)
+    ring = None
+    if config['general']['ring_path']:
+        try:
+            from ringbuffer import RingBuffer
+        except ImportError:
+            raise RuntimeError("RING_BUFFER_PATH needs numpy, install it with 'pip3 install numpy'")
+        ring = RingBuffer(config['general']['ring_path'])
+    engine = RuleEngine(rules, mailer, config['notifier']['lookback'], states, ring,
+                        config['retention']['enabled'])
+    scheduler = Scheduler(config['general']['sampling_time'])
+    try:
+        scheduler.run(check, engine, database)
+    except (KeyboardInterrupt, SystemExit):
+        print('Application terminated by keyboard interrupt (ctrl-c).')
+        sys.exit()
+    finally:
+        database.close()
+        mailer.close()
+        states.close()
+        if ring is not None:
+            ring.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+""" Compact datapoints and a direct influxdb line protocol encoder
+
+    A Schema describes one measurement (its tag keys and field keys) and holds everything
+    that is the same for all of its points, most importantly the escaped line protocol
+    snippets. A Point only keeps the schema, a tuple of tag values, a tuple of field values
+    and an integer nanosecond timestamp, so a batch of thousands of points is cheap to
+    build and to encode.
+"""
+import datetime
+from io import StringIO
+import time
+
+_EPOCH = datetime.datetime(1970, 1, 1)
+
+
+def _escape_key(value: str) -> str:
+    return value.replace('\\', '\\\\').replace(',', '\\,').replace('=', '\\=').replace(' ', '\\ ')
+
+
+def _escape_measurement(value: str) -> str:
+    return value.replace('\\', '\\\\').replace(',', '\\,').replace(' ', '\\ ')
+
+
+def _format_field(value) -> str:
+    # bool before int, bool is a subclass of int
+    if value is True:
+        return 'true'
+    if value is False:
+        return 'false'
+    if isinstance(value, int):
+        return f'{value}i'
+    if isinstance(value, float):
+        return repr(value)
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def now_ns() -> int:
+    """ Current UTC time in nanoseconds since the epoch """
+
+    return time.time_ns()
+
+
+def from_ns(value: int) -> datetime.datetime:
+    """ Naive UTC datetime of a nanosecond timestamp (precision is cut to microseconds) """
+
+    return _EPOCH + datetime.timedelta(microseconds=value // 1000)
+
+
+class Schema:
+    """ Measurement name, tag keys and field keys shared by all points of one kind """
+
+    def __init__(self, measurement: str, tag_keys: tuple, field_keys: tuple):
+        self.measurement = measurement
+        self.tag_keys = tuple(tag_keys)
+        self.field_keys = tuple(field_keys)
+        # influxdb expects tags sorted by key, so sort once and remember where each value sits
+        order = sorted(range(len(self.tag_keys)), key=lambda index: self.tag_keys[index])
+        self.tag_prefixes = tuple((index, f',{_escape_key(self.tag_keys[index])}=') for index in order)
+        self.field_prefixes = tuple(f',{_escape_key(key)}=' for key in self.field_keys)
+        self.prefix = _escape_measurement(measurement)
+
+    def point(self, tags: tuple, timestamp: int, fields: tuple) -> 'Point':
+        return Point(self, tags, timestamp, fields)
+
+    def __repr__(self):
+        return f"Schema({self.measurement!r}, {self.tag_keys!r}, {self.field_keys!r})"
+
+
+class Point:
+    """ One datapoint, tag and field values are stored in the order of the schema keys """
+
+    __slots__ = ('schema', 'tag_values', 'time', 'field_values')
+
+    def __init__(self, schema: Schema, tag_values: tuple, timestamp: int, field_values: tuple):
+        self.schema = schema
+        self.tag_values = tag_values
+        self.time = timestamp
+        self.field_values = field_values
+
+    @property
+    def measurement(self) -> str:
+        return self.schema.measurement
+
+    @property
+    def tags(self) -> dict:
+        return dict(zip(self.schema.tag_keys, self.tag_values))
+
+    @property
+    def fields(self) -> dict:
+        """ Fields with a value, None values are not stored """
+
+        return {key: value for key, value in zip(self.schema.field_keys, self.field_values) if value is not None}
+
+    def __repr__(self):
+        return f"Point({self.measurement!r}, tags={self.tags!r}, time={self.time}, fields={self.fields!r})"
+
+
+class LineEncoder:
+    """ Encodes batches of points to line protocol into one reused buffer """
+
+    def __init__(self):
+        self.buffer = StringIO()
+
+    def encode(self, points) -> str:
+        """ Line protocol of the points, one line per point without a trailing newline """
+
+        buffer = self.buffer
+        buffer.seek(0)
+        buffer.truncate()
+        write = buffer.write
+        tag_cache = {}
+        last_time = None
+        time_suffix = ''
+        for point in points:
+            schema = point.schema
+            fields = [prefix + _format_field(value)
+                      for prefix, value in zip(schema.field_prefixes, point.field_values) if value is not None]
+            if not fields:
+                continue
+
+            write(schema.prefix)
+            for index, prefix in schema.tag_prefixes:
+                value = point.tag_values[index]
+                if value is None or value == '':
+                    continue
+                # points of one batch share many tag values (e.g. runNum), escape each value once
+                tag = tag_cache.get((prefix, value))
+                if tag is None:
+                    tag = tag_cache[(prefix, value)] = prefix + _escape_key(str(value))
+                write(tag)
+            if point.time != last_time:
+                last_time = point.time
+                time_suffix = f' {point.time}\n'
+
+            write(' ')
+            write(fields[0][1:])
+            for field in fields[1:]:
+                write(field)
+            write(time_suffix)
+
+        return buffer.getvalue().rstrip('\n')
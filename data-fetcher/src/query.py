@@ -0,0 +1,109 @@
+""" Typed read access to influxdb shared by the fetcher and the notifier
+
+    Statements only select the fields that are needed and are bounded in time, so their
+    cost does not grow with the age of a measurement. The one exception is select_newest,
+    the data age check has to find the newest point however old it is.
+"""
+from collections import namedtuple
+import datetime
+
+# One result row: tags are strings, fields hold the selected values (or aggregates)
+Row = namedtuple('Row', ['measurement', 'tags', 'time', 'fields'])
+
+AGGREGATES = ('min', 'max', 'mean')
+
+# Seconds per unit of an influxql duration literal like '30m' or '7d'
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def quote_ident(name: str) -> str:
+    return '"{}"'.format(name.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def quote_time(timestamp: datetime.datetime) -> str:
+    return "'{}Z'".format(timestamp.replace(tzinfo=None).isoformat())
+
+
+def duration_seconds(duration: str) -> float:
+    """ Length of a duration literal (e.g. '30m') in seconds """
+
+    return float(duration[:-1]) * DURATION_UNITS[duration[-1]]
+
+
+def select_latest(measurement: str, fields: list, lookback: str = '7d') -> str:
+    """ Newest point of every series within the lookback window, only the given fields """
+
+    columns = ', '.join(quote_ident(field) for field in fields)
+
+    return (f"SELECT {columns} FROM {quote_ident(measurement)} WHERE time > now() - {lookback} "
+            f"GROUP BY * ORDER BY time DESC LIMIT 1")
+
+
+def select_newest(measurement: str, field: str) -> str:
+    """ Newest value of a field over all series, not bounded in time """
+
+    return f"SELECT last({quote_ident(field)}) FROM {quote_ident(measurement)}"
+
+
+def select_aggregates(measurement: str, field: str, window: str, functions: tuple = AGGREGATES) -> str:
+    """ Aggregates (min/max/mean) of a field over the last `window` for every series """
+
+    columns = ', '.join(f"{function}({quote_ident(field)}) AS {quote_ident(function)}" for function in functions)
+
+    return f"SELECT {columns} FROM {quote_ident(measurement)} WHERE time > now() - {window} GROUP BY *"
+
+
+def select_rollup_aggregates(policy: str, measurement: str, field: str, window: str) -> str:
+    """ Aggregates (min/max/mean) of a field over the last `window` from its min/max/mean rollup """
+
+    columns = ', '.join(f"{function}({quote_ident(f'{field}_{function}')}) AS {quote_ident(function)}"
+                        for function in AGGREGATES)
+
+    return (f"SELECT {columns} FROM {quote_ident(policy)}.{quote_ident(measurement)} "
+            f"WHERE time > now() - {window} GROUP BY *")
+
+
+def select_range(measurement: str, fields: list, start: datetime.datetime, end: datetime.datetime) -> str:
+    """ All points of the given fields with start <= time < end """
+
+    columns = ', '.join(quote_ident(field) for field in fields) if fields else '*'
+
+    return (f"SELECT {columns} FROM {quote_ident(measurement)} "
+            f"WHERE time >= {quote_time(start)} AND time < {quote_time(end)} GROUP BY *")
+
+
+def _rows(result_set) -> list:
+    rows = []
+    for (measurement, tags), points in result_set.items():
+        for point in points:
+            fields = {key: value for key, value in point.items() if key != 'time'}
+            rows.append(Row(measurement, tags or {}, point['time'], fields))
+
+    return rows
+
+
+class QueryLayer:
+    """ Runs statements built by the select_* functions against a Database """
+
+    def __init__(self, database):
+        self.database = database
+
+    def run(self, statements: list) -> list:
+        """ Run several statements in one request, returns one list of rows per statement """
+
+        if not statements:
+            return []
+        results = self.database.query('; '.join(statements))
+        if not isinstance(results, list):
+            results = [results]
+
+        return [_rows(result) for result in results]
+
+    def stream(self, statement: str, chunk_size: int = 10000, epoch: str = None):
+        """ Yield the rows of a large statement chunk by chunk (chunked=True)
+
+            With an epoch (e.g. 'ns') times are returned as integers instead of RFC3339 strings.
+        """
+
+        for result in self.database.query(statement, chunked=True, chunk_size=chunk_size, epoch=epoch):
+            yield from _rows(result)
@@ -0,0 +1,125 @@
+""" Retention policies and continuous queries that roll raw points up for long-term storage
+
+    Weather is rolled up to hourly and daily min/max/mean per location, RKI data to the last
+    value per day and district. Rollups live in their own retention policies, so the raw
+    points can expire (RAW_RETENTION) while the small rollup series are kept for years.
+"""
+from collections import namedtuple
+import datetime
+import hashlib
+import logging
+
+from fetch import RKI_FIELDS, RKI_TAGS, WEATHER_FIELDS
+from query import quote_ident, quote_time
+
+# One continuous query: source measurement, target retention policy and measurement, GROUP BY interval and columns
+Rollup = namedtuple('Rollup', ['name', 'measurement', 'policy', 'target', 'interval', 'columns'])
+
+HOURLY_POLICY = 'rollup_1h'
+DAILY_POLICY = 'rollup_1d'
+# openweathermap fields that are numeric, `wetter` is a description
+WEATHER_ROLLUP_FIELDS = [field for field in WEATHER_FIELDS if field != 'wetter']
+CQ_PREFIX = 'rollup_'
+
+
+def min_max_mean(fields: list) -> str:
+    return ', '.join(f"{function}({quote_ident(field)}) AS {quote_ident(f'{field}_{function}')}"
+                     for field in fields for function in ('min', 'max', 'mean'))
+
+
+def hourly_rollup(measurement: str) -> tuple:
+    """ (retention policy, measurement) of the hourly rollup of a weather measurement """
+
+    return HOURLY_POLICY, f'{measurement}_1h'
+
+
+def build_rollups(config: dict) -> list:
+    """ The rollups of the weather and the RKI measurement """
+
+    table_weather = config['influxdb']['table_weather']
+    table_rki = config['influxdb']['table_rki']
+    # outside bulk mode AdmUnitId and BundeslandId are fields
+    rki_fields = RKI_FIELDS if config['rki']['bulk'] else RKI_TAGS + RKI_FIELDS
+
+    return [
+        Rollup(f'{table_weather}_1h', table_weather, HOURLY_POLICY, f'{table_weather}_1h', '1h',
+               min_max_mean(WEATHER_ROLLUP_FIELDS)),
+        Rollup(f'{table_weather}_1d', table_weather, DAILY_POLICY, f'{table_weather}_1d', '1d',
+               min_max_mean(WEATHER_ROLLUP_FIELDS)),
+        Rollup(f'{table_rki}_1d', table_rki, DAILY_POLICY, f'{table_rki}_1d', '1d',
+               ', '.join(f"last({quote_ident(field)}) AS {quote_ident(field)}" for field in rki_fields))
+    ]
+
+
+class RetentionManager:
+    """ Creates the retention policies and continuous queries of the rollups in influxdb
+
+        apply() is idempotent. Continuous queries cannot be altered, so their name carries
+        a hash of their statement: a changed rollup is dropped and created again.
+    """
+
+    def __init__(self, database, config: dict):
+        self.database = database
+        self.dbname = config['influxdb']['dbname']
+        self.retention = config['retention']
+        self.rollups = build_rollups(config)
+
+    def _select(self, rollup: Rollup, where: str = '') -> str:
+        return (f"SELECT {rollup.columns} INTO {quote_ident(self.dbname)}.{quote_ident(rollup.policy)}."
+                f"{quote_ident(rollup.target)} FROM {quote_ident(rollup.measurement)}{where} "
+                f"GROUP BY time({rollup.interval}), *")
+
+    def _cq_name(self, rollup: Rollup) -> str:
+        digest = hashlib.blake2b(self._select(rollup).encode(), digest_size=4).hexdigest()
+        return f'{CQ_PREFIX}{rollup.name}_{digest}'
+
+    def apply_policies(self):
+        database = quote_ident(self.dbname)
+        result = self.database.query(f"SHOW RETENTION POLICIES ON {database}")
+        policies = {row['name']: row for row in result.get_points()}
+
+        wanted = {HOURLY_POLICY: self.retention['hourly'], DAILY_POLICY: self.retention['daily']}
+        raw = self.retention['raw']
+        if raw:
+            # raw points are written to the default retention policy
+            default = next((name for name, row in policies.items() if row.get('default')), 'autogen')
+            wanted[default] = raw
+        for name, duration in wanted.items():
+            verb = 'ALTER' if name in policies else 'CREATE'
+            replication = '' if name in policies else ' REPLICATION 1'
+            self.database.query(
+                f"{verb} RETENTION POLICY {quote_ident(name)} ON {database} DURATION {duration}{replication}",
+                method='POST')
+            logging.info(f"Retention policy {name}: {duration}")
+
+    def apply_continuous_queries(self):
+        existing = set()
+        for row in self.database.query("SHOW CONTINUOUS QUERIES").get_points(measurement=self.dbname):
+            if row['name'].startswith(CQ_PREFIX):
+                existing.add(row['name'])
+
+        wanted = {self._cq_name(rollup): rollup for rollup in self.rollups}
+        for name in existing - set(wanted):
+            logging.info(f"Dropping continuous query {name}")
+            self.database.query(f"DROP CONTINUOUS QUERY {quote_ident(name)} ON {quote_ident(self.dbname)}",
+                                method='POST')
+        for name, rollup in wanted.items():
+            if name not in existing:
+                logging.info(f"Creating continuous query {name}")
+                self.database.query(f"CREATE CONTINUOUS QUERY {quote_ident(name)} ON {quote_ident(self.dbname)} "
+                                    f"BEGIN {self._select(rollup)} END", method='POST')
+
+    def apply(self):
+        """ Create or update the retention policies and continuous queries """
+
+        self.apply_policies()
+        self.apply_continuous_queries()
+
+    def backfill(self, start: datetime.datetime, end: datetime.datetime):
+        """ Compute the rollups of points between start and end, e.g. after a backfill """
+
+        for rollup in self.rollups:
+            where = f" WHERE time >= {quote_time(start)} AND time < {quote_time(end)}"
+            self.database.query(self._select(rollup, where), method='POST')
+            logging.info(f"Rolled up {rollup.measurement} into {rollup.policy}.{rollup.target} "
+                         f"from {start:%Y-%m-%d} to {end:%Y-%m-%d}")
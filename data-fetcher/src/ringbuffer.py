@@ -0,0 +1,198 @@
+""" Memory-mapped ring buffer of recent readings shared by the fetcher and the notifier
+
+    The fetcher appends one fixed-size record per numeric field of every point it stored,
+    the notifier maps the same file and reads the latest values and windowed min/max/mean
+    straight from it with NumPy, so its checks keep working while influxdb is down.
+
+    There is a single writer. Readers use the sequence number in the header like a
+    seqlock: it is odd while records are written, a read is repeated when it changed.
+"""
+import logging
+import os
+from threading import Lock
+import time
+
+import numpy as np
+
+MAGIC = b'WCRING02'
+HEADER = np.dtype([('magic', 'S8'), ('capacity', '<u8'), ('count', '<u8'), ('sequence', '<u8')])
+HEADER_SIZE = 64
+# Series are stored as the sorted tag set, e.g. b'location=Bochum,runNum=1'
+RECORD = np.dtype([('time', '<i8'), ('measurement', 'S32'), ('series', 'S128'),
+                   ('field', 'S32'), ('value', '<f8')])
+# numpy silently cuts longer values, records that do not fit are not stored
+MAX_MEASUREMENT = RECORD['measurement'].itemsize
+MAX_SERIES = RECORD['series'].itemsize
+MAX_FIELD = RECORD['field'].itemsize
+
+
+def series_key(tags: dict) -> bytes:
+    return ','.join(f'{key}={value}' for key, value in sorted(tags.items()) if value not in (None, '')).encode()
+
+
+def series_tags(key: bytes) -> dict:
+    return dict(pair.split('=', 1) for pair in key.decode().split(',') if pair)
+
+
+class RingBuffer:
+    """ Fixed number of (time, measurement, series, field, value) records in a file
+
+        Opened with a capacity the file is created (or recreated if its capacity differs)
+        for writing, without one an existing file is mapped read-only on first use.
+    """
+
+    def __init__(self, path: str, capacity: int = None, fields: list = None):
+        self.path = path
+        self.capacity = capacity
+        self.fields = set(fields or [])
+        self.lock = Lock()
+        self.header = None
+        self.records = None
+        self.skipped = set()
+        if capacity is not None:
+            self._create()
+
+    def _create(self):
+        size = HEADER_SIZE + self.capacity * RECORD.itemsize
+        if os.path.exists(self.path):
+            header = np.fromfile(self.path, dtype=HEADER, count=1)
+            if len(header) and header[0]['magic'] == MAGIC and header[0]['capacity'] == self.capacity \
+                    and os.path.getsize(self.path) == size:
+                self._map('r+')
+                return
+            logging.info(f"Recreating ring buffer {self.path} with {self.capacity} records")
+        with open(self.path, 'wb') as file:
+            file.truncate(size)
+        self._map('r+')
+        self.header['magic'] = MAGIC
+        self.header['capacity'] = self.capacity
+
+    def _map(self, mode: str):
+        self.header = np.memmap(self.path, dtype=HEADER, mode=mode, shape=(1,))
+        capacity = self.capacity or int(self.header[0]['capacity'])
+        self.records = np.memmap(self.path, dtype=RECORD, mode=mode, offset=HEADER_SIZE, shape=(capacity,))
+        self.capacity = capacity
+
+    def _ready(self) -> bool:
+        """ Map the file for reading if that has not happened yet, False if it does not exist """
+
+        if self.records is None:
+            if not os.path.exists(self.path) or os.path.getsize(self.path) < HEADER_SIZE:
+                return False
+            header = np.fromfile(self.path, dtype=HEADER, count=1)
+            if header[0]['magic'] != MAGIC:
+                return False
+            self._map('r')
+        return True
+
+    @staticmethod
+    def accepts(measurement: str, fields: list) -> bool:
+        """ Whether records of the measurement and fields fit into the buffer """
+
+        return len(measurement.encode()) <= MAX_MEASUREMENT and all(len(field.encode()) <= MAX_FIELD for field in fields)
+
+    def _skip(self, measurement: str, series: bytes):
+        if (measurement, series) not in self.skipped:
+            self.skipped.add((measurement, series))
+            logging.warning(f"Not keeping {measurement} {series.decode()} in the ring buffer, the name is too long "
+                            f"(at most {MAX_MEASUREMENT} bytes, {MAX_SERIES} for the tags)")
+
+    def append(self, datapoints: list) -> int:
+        """ Store the numeric values of the configured fields of the points, returns the record count """
+
+        rows = []
+        for point in datapoints:
+            measurement = point.measurement.encode()
+            series = series_key(point.tags)
+            if len(measurement) > MAX_MEASUREMENT or len(series) > MAX_SERIES:
+                self._skip(point.measurement, series)
+                continue
+            for field, value in zip(point.schema.field_keys, point.field_values):
+                if field in self.fields and isinstance(value, (int, float)) and not isinstance(value, bool) \
+                        and len(field.encode()) <= MAX_FIELD:
+                    rows.append((point.time, measurement, series, field.encode(), value))
+        if not rows:
+            return 0
+        # more than fit would overwrite themselves, keep the newest
+        batch = np.array(rows[-self.capacity:], dtype=RECORD)
+
+        # fetch jobs of several sources may append at the same time, they share one writer
+        with self.lock:
+            header = self.header[0]
+            count = int(header['count'])
+            header['sequence'] += 1
+            start = count % self.capacity
+            head = min(len(batch), self.capacity - start)
+            self.records[start:start + head] = batch[:head]
+            self.records[:len(batch) - head] = batch[head:]
+            header['count'] = count + len(batch)
+            header['sequence'] += 1
+
+        return len(batch)
+
+    def _read(self, function, retries: int = 5):
+        """ Run function(records) on the valid records, repeated if the writer interfered """
+
+        if not self._ready():
+            return None
+        header = self.header[0]
+        for _ in range(retries):
+            sequence = int(header['sequence'])
+            if sequence % 2:
+                time.sleep(0.001)
+                continue
+            records = self.records[:min(int(header['count']), self.capacity)]
+            result = function(records)
+            if int(header['sequence']) == sequence:
+                return result
+        logging.warning(f"Ring buffer {self.path} is busy, giving up reading")
+        return None
+
+    def latest(self, measurement: str, fields: list, since: int = 0) -> list:
+        """ Latest value of each field per series newer than since (ns), as (tags, time, fields) """
+
+        def select(records):
+            selected = records[(records['measurement'] == measurement.encode())
+                               & np.isin(records['field'], [field.encode() for field in fields])
+                               & (records['time'] > since)]
+            if not len(selected):
+                return []
+            # sorted by series, field and time, the last record of each (series, field) group is the latest
+            selected = selected[np.lexsort((selected['time'], selected['field'], selected['series']))]
+            keys = selected[['series', 'field']]
+            last = np.append(keys[1:] != keys[:-1], True)
+            series = {}
+            for record in selected[last]:
+                entry = series.setdefault(record['series'], [0, {}])
+                entry[0] = max(entry[0], int(record['time']))
+                entry[1][record['field'].decode()] = float(record['value'])
+            return [(series_tags(key), timestamp, fields) for key, (timestamp, fields) in series.items()]
+
+        return self._read(select) or []
+
+    def aggregates(self, measurement: str, field: str, since: int) -> list:
+        """ min/max/mean of a field per series over the records newer than since (ns), as (tags, values) """
+
+        def select(records):
+            selected = records[(records['measurement'] == measurement.encode())
+                               & (records['field'] == field.encode()) & (records['time'] > since)]
+            if not len(selected):
+                return []
+            keys, index = np.unique(selected['series'], return_inverse=True)
+            values = selected['value']
+            minimum = np.full(len(keys), np.inf)
+            maximum = np.full(len(keys), -np.inf)
+            np.minimum.at(minimum, index, values)
+            np.maximum.at(maximum, index, values)
+            mean = np.bincount(index, weights=values) / np.bincount(index)
+            return [(series_tags(key), {'min': float(low), 'max': float(high), 'mean': float(average)})
+                    for key, low, high, average in zip(keys, minimum, maximum, mean)]
+
+        return self._read(select) or []
+
+    def close(self):
+        if self.records is not None and self.records.mode == 'r+':
+            self.header.flush()
+            self.records.flush()
+        self.header = None
+        self.records = None
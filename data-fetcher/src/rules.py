@@ -0,0 +1,269 @@
+from collections import namedtuple
+import datetime
+import os
+
+from points import from_ns
+
+pwd = os.path.dirname(os.path.abspath(__file__))
+GIF_DIR = os.path.join(pwd, 'gifs')
+
+# Notification produced by a rule, attachment is an optional file path
+Alert = namedtuple('Alert', ['subject', 'body', 'attachment'])
+
+
+def parse_time(value) -> datetime.datetime:
+    """ Convert an influxdb/ISO or nanosecond timestamp to a naive UTC datetime """
+
+    if isinstance(value, datetime.datetime):
+        timestamp = value
+    elif isinstance(value, int):
+        timestamp = from_ns(value)
+    else:
+        timestamp = datetime.datetime.fromisoformat(value.replace('Z', '+00:00'))
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+
+    return timestamp
+
+
+class Snapshot:
+    """ Latest point of every series, keyed by measurement and tag set """
+
+    def __init__(self):
+        self.series = {}
+        self.aggregates = {}
+        # newest time per measurement as read from influxdb, not from fetched points or the ring buffer
+        self.stored = {}
+
+    def update(self, measurement: str, tags: dict, timestamp, fields: dict):
+        """ Remember a point, older points than the known one of the series are ignored """
+
+        timestamp = parse_time(timestamp)
+        # influxdb returns tag values as strings, the fetcher may hand over numbers
+        tags = {key: str(value) for key, value in (tags or {}).items()}
+        key = tuple(sorted(tags.items()))
+        series = self.series.setdefault(measurement, {})
+        known = series.get(key)
+        if known is None or known['time'] <= timestamp:
+            series[key] = {'time': timestamp, 'tags': tags, 'fields': fields}
+
+    def update_stored(self, measurement: str, timestamp):
+        """ Remember the time of a point read from influxdb, None if influxdb holds no point of it """
+
+        if timestamp is None:
+            self.stored.setdefault(measurement, None)
+            return
+        timestamp = parse_time(timestamp)
+        known = self.stored.get(measurement)
+        if known is None or known < timestamp:
+            self.stored[measurement] = timestamp
+
+    def newest_stored(self, measurement: str):
+        """ Time of the newest point of the measurement in influxdb, None if it is unknown or there is none """
+
+        return self.stored.get(measurement)
+
+    def read_stored(self, measurement: str) -> bool:
+        """ Whether influxdb was read for the newest point of the measurement """
+
+        return measurement in self.stored
+
+    def update_aggregates(self, measurement: str, tags: dict, values: dict):
+        """ Remember windowed aggregates (e.g. min/max/mean) of a series """
+
+        key = tuple(sorted((key, str(value)) for key, value in (tags or {}).items()))
+        self.aggregates.setdefault(measurement, {})[key] = values
+
+    def aggregate(self, measurement: str, tags: dict, function: str):
+        """ Aggregate of a series from the last refresh, None if unknown """
+
+        key = tuple(sorted((tags or {}).items()))
+        return self.aggregates.get(measurement, {}).get(key, {}).get(function)
+
+    def observe(self, datapoints: list):
+        """ Take over datapoints as prepared by the Fetcher """
+
+        for point in datapoints:
+            self.update(point.measurement, point.tags, point.time, point.fields)
+
+    def latest(self, measurement: str) -> list:
+        """ Latest point of every series of the measurement """
+
+        return list(self.series.get(measurement, {}).values())
+
+    def newest(self, measurement: str):
+        """ Most recent point of the measurement over all series, None if there is none """
+
+        return max(self.latest(measurement), key=lambda point: point['time'], default=None)
+
+
+class Rule:
+    """ Base class of a notification check
+
+        evaluate() returns the alerts whose condition currently holds, keyed by a stable id.
+        `active` holds the ids that were active before, so threshold rules can apply a
+        hysteresis band before clearing them. Whether an alert is mailed is decided by
+        the engine from `cooldown`, `dedup_window` and `repeat` (see alerts.should_send).
+    """
+
+    name = 'rule'
+    measurement = None
+    # fields of the measurement the rule reads from the latest point
+    fields = []
+    # (field, window) if the rule uses windowed min/max/mean, e.g. ('temperatur', '30m')
+    aggregates = None
+    repeat = False
+    # True if the rule checks what influxdb holds instead of the latest readings
+    from_database = False
+
+    def __init__(self, interval: float = 0, cooldown: float = 0, dedup_window: float = 0):
+        # minimum number of seconds between two evaluations, 0 evaluates on every tick
+        self.interval = interval
+        self.cooldown = cooldown
+        self.dedup_window = dedup_window
+
+    def evaluate(self, snapshot: Snapshot, now: datetime.datetime, active: set = frozenset()) -> dict:
+        raise NotImplementedError
+
+
+class DataAgeRule(Rule):
+    """ Warns when the newest point of a measurement in influxdb is older than max_age_hours
+
+        It checks influxdb itself, the readings in the ring buffer or handed over in-process are
+        still new while influxdb is down.
+    """
+
+    name = 'data_age'
+    repeat = True
+    from_database = True
+
+    def __init__(self, measurement: str, field: str, max_age_hours: float = 1, interval: float = 1800,
+                 cooldown: float = 21600):
+        super().__init__(interval, cooldown)
+        self.measurement = measurement
+        self.fields = [field]
+        self.max_age_hours = max_age_hours
+
+    def evaluate(self, snapshot, now, active=frozenset()):
+        newest = snapshot.newest_stored(self.measurement)
+        if newest is None and snapshot.read_stored(self.measurement):
+            # influxdb was read and holds nothing, e.g. the retention policy removed it all
+            return {
+                self.name: Alert(
+                    "WARNING: Database Age Alert",
+                    f"Database holds no data of {self.measurement}!\n",
+                    os.path.join(GIF_DIR, 'giphy.gif'))
+            }
+        if newest is None:
+            return {}
+
+        delta = now - newest
+        age_in_hours = round(delta.total_seconds() / 3600)
+        if age_in_hours <= self.max_age_hours:
+            return {}
+
+        return {
+            self.name: Alert(
+                "WARNING: Database Age Alert",
+                f"Database was last updated {age_in_hours} hours ago!\n",
+                os.path.join(GIF_DIR, 'giphy.gif'))
+        }
+
+
+class TemperatureRule(Rule):
+    """ Notifies once when the temperature of a location reaches the high or drops below the low threshold
+
+        With a window (e.g. '30m') the mean over the window is checked instead of the latest value.
+    """
+
+    name = 'temperature'
+    fields = ['temperatur']
+
+    def __init__(self, measurement: str, low_threshold: float, high_threshold: float,
+                 window: str = None, hysteresis: float = 0, interval: float = 0,
+                 cooldown: float = 0, dedup_window: float = 0):
+        super().__init__(interval, cooldown, dedup_window)
+        self.measurement = measurement
+        self.low_threshold = low_threshold
+        self.high_threshold = high_threshold
+        self.hysteresis = hysteresis
+        if window:
+            self.aggregates = ('temperatur', window)
+
+    def evaluate(self, snapshot, now, active=frozenset()):
+        alerts = {}
+        for point in snapshot.latest(self.measurement):
+            temperature = point['fields'].get('temperatur')
+            if self.aggregates is not None:
+                mean = snapshot.aggregate(self.measurement, point['tags'], 'mean')
+                temperature = mean if mean is not None else temperature
+            if temperature is None:
+                continue
+            location = point['tags'].get('location', '')
+            where = f" in {location}" if location else ""
+            temp = round(temperature, 2)
+            # active alerts only clear once the temperature is back beyond the hysteresis band
+            high = self.high_threshold - (self.hysteresis if f"high_temp:{location}" in active else 0)
+            low = self.low_threshold + (self.hysteresis if f"low_temp:{location}" in active else 0)
+            if temperature >= high:
+                alerts[f"high_temp:{location}"] = Alert(
+                    "INFO: High Temperature Notification",
+                    f"The outside temperature{where} has reached {temp}°C!\n",
+                    os.path.join(GIF_DIR, 'gif_high_temp.gif'))
+            if temperature < low:
+                alerts[f"low_temp:{location}"] = Alert(
+                    "INFO: Low Temperature Notification",
+                    f"The outside temperature{where} has dropped below {temp}°C!\n",
+                    os.path.join(GIF_DIR, 'gif_low_temp.gif'))
+
+        return alerts
+
+
+class IncidenceRule(Rule):
+    """ Notifies once when the 7-day incidence of a district reaches the threshold """
+
+    name = 'incidence'
+    fields = ['Inz7T']
+
+    def __init__(self, measurement: str, threshold: float, hysteresis: float = 0, interval: float = 0,
+                 cooldown: float = 0, dedup_window: float = 0):
+        super().__init__(interval, cooldown, dedup_window)
+        self.measurement = measurement
+        self.threshold = threshold
+        self.hysteresis = hysteresis
+
+    def evaluate(self, snapshot, now, active=frozenset()):
+        alerts = {}
+        for point in snapshot.latest(self.measurement):
+            incidence = point['fields'].get('Inz7T')
+            district = point['tags'].get('AdmUnitId', point['fields'].get('AdmUnitId', ''))
+            key = f"incidence:{district}"
+            threshold = self.threshold - (self.hysteresis if key in active else 0)
+            if incidence is None or incidence < threshold:
+                continue
+            alerts[key] = Alert(
+                "INFO: Incidence Notification",
+                f"The 7-day incidence of district {district} has reached {round(incidence, 1)}!\n",
+                None)
+
+        return alerts
+
+
+def build_rules(config: dict) -> list:
+    """ Create the rules enabled in the config """
+
+    table_weather = config['influxdb']['table_weather']
+    table_rki = config['influxdb']['table_rki']
+    notifier = config['notifier']
+
+    rules = [DataAgeRule(table_weather, 'temperatur', notifier['max_age_hours'], notifier['age_check_interval'],
+                         cooldown=notifier['age_alert_cooldown'])]
+    if notifier['low_temp_threshold'] is not None and notifier['high_temp_threshold'] is not None:
+        rules.append(TemperatureRule(table_weather, notifier['low_temp_threshold'], notifier['high_temp_threshold'],
+                                     notifier['temp_window'], notifier['temp_hysteresis'],
+                                     cooldown=notifier['alert_cooldown'], dedup_window=notifier['alert_dedup_window']))
+    if notifier['incidence_threshold'] is not None:
+        rules.append(IncidenceRule(table_rki, notifier['incidence_threshold'], notifier['incidence_hysteresis'],
+                                   cooldown=notifier['alert_cooldown'], dedup_window=notifier['alert_dedup_window']))
+
+    return rules
@@ -0,0 +1,222 @@
+import logging
+import random
+from threading import Event
+import time
+
+from metrics import SCHEDULER_LAG, TICK_DURATION
+
+
+class Scheduler:
+    """ Runs a job at a fixed period without drifting
+
+        Ticks are planned on a fixed grid (start + n * period) using a monotonic clock, so
+        the duration of a job does not delay later ticks. Ticks that were missed because a
+        job overran the period are skipped instead of being run back to back.
+    """
+
+    def __init__(self, period: float):
+        self.period = period
+        self.stopped = Event()
+
+    def stop(self):
+        self.stopped.set()
+
+    def run(self, job, *args):
+        """ Call job(*args) every period seconds until stop() is called """
+
+        name = getattr(job, '__name__', str(job))
+        next_run = time.monotonic()
+        while not self.stopped.is_set():
+            start = time.monotonic()
+            SCHEDULER_LAG.observe(max(0.0, start - next_run))
+            try:
+                job(*args)
+            except Exception:
+                logging.exception(f"Job {name} failed")
+            TICK_DURATION.observe(time.monotonic() - start, job=name)
+
+            next_run += self.period
+            now = time.monotonic()
+            if now > next_run:
+                missed = int((now - next_run) // self.period) + 1
+                logging.warning(f"Job overran sampling period, skipping {missed} tick(s)")
+                next_run += missed * self.period
+            self.stopped.wait(next_run - time.monotonic())
+
+
+class SourceSchedule:
+    """ Learns how often an upstream source publishes new data and when to poll it next
+
+        The update interval is a moving average of the distance between distinct source
+        timestamps (e.g. `dt` of openweathermap), seen by consecutive successful polls of this
+        process. A distance of more than OUTLIER_FACTOR intervals is an outage of the source
+        and is not learned, unless it is seen OUTLIER_LIMIT times in a row. The next poll is
+        planned `margin` seconds after the next expected update; while the source has not changed yet it is polled
+        again in short steps, never more often than every min_interval seconds. Failed polls
+        back off exponentially with jitter up to max_backoff seconds.
+    """
+
+    SMOOTHING = 0.3
+    # an unchanged source is polled again after this fraction of its update interval
+    RETRY_FRACTION = 0.02
+    OUTLIER_FACTOR = 4
+    OUTLIER_LIMIT = 3
+
+    def __init__(self, name: str, min_interval: float, max_interval: float = 172800, margin: float = 30,
+                 max_backoff: float = 3600, state: dict = None):
+        self.name = name
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.margin = margin
+        self.max_backoff = max_backoff
+        state = state or {}
+        self.interval = state.get('interval')
+        self.source_time = state.get('source_time')
+        self.errors = 0
+        # False after a start or a failed poll, updates may have been missed since the last source time
+        self.continuous = False
+        self.outliers = 0
+        self.next_poll = time.time()
+
+    def state(self) -> dict:
+        """ What was learned about the source, to be restored after a restart """
+
+        return {'interval': self.interval, 'source_time': self.source_time}
+
+    def observe(self, source_time: float, now: float = None) -> bool:
+        """ Plan the next poll after a successful one, returns whether the source changed """
+
+        now = now or time.time()
+        self.errors = 0
+        changed = source_time != self.source_time
+        if changed and self.continuous and self.source_time is not None and source_time > self.source_time:
+            self._learn(source_time - self.source_time)
+        if changed:
+            self.source_time = source_time
+        self.continuous = True
+
+        expected = self.source_time + self.interval + self.margin if self.interval else None
+        if expected is not None and expected > now:
+            self.next_poll = expected
+        else:
+            self.next_poll = now + max(self.min_interval, (self.interval or 0) * self.RETRY_FRACTION)
+
+        return changed
+
+    def _learn(self, delta: float):
+        """ Update the interval with the distance between two source times """
+
+        if self.interval is not None and delta > self.OUTLIER_FACTOR * self.interval:
+            self.outliers += 1
+            if self.outliers < self.OUTLIER_LIMIT:
+                logging.info(f"{self.name}: not learning from a gap of {delta:.0f} sec between updates")
+                return
+        self.outliers = 0
+        interval = delta if self.interval is None else \
+            (1 - self.SMOOTHING) * self.interval + self.SMOOTHING * delta
+        self.interval = min(max(interval, self.min_interval), self.max_interval)
+
+    def failed(self, now: float = None) -> float:
+        """ Plan the next poll after a failed one, returns the delay """
+
+        now = now or time.time()
+        self.errors += 1
+        self.continuous = False
+        delay = min(self.max_backoff, self.min_interval * 2 ** (self.errors - 1))
+        delay = delay / 2 + random.uniform(0, delay / 2)
+        self.next_poll = now + delay
+
+        return delay
+
+
+class AdaptiveScheduler:
+    """ Polls every source when its SourceSchedule says so
+
+        A job returns the timestamp (epoch seconds) of the newest data the source had, or
+        None if it returned nothing, which counts as a failure like an exception does.
+        With a Supervisor the due sources are polled concurrently, each with a deadline, and
+        every source is planned again as soon as its own poll ended, so a slow source does not
+        delay the others. `after` is called whenever polls ended, `save(name, state)` whenever
+        a schedule learned something new.
+    """
+
+    def __init__(self, after=None, save=None, supervisor=None):
+        self.after = after
+        self.save = save
+        self.supervisor = supervisor
+        self.sources = []
+        self.stopped = Event()
+
+    def add(self, schedule: SourceSchedule, job, *args):
+        self.sources.append((schedule, job, args))
+
+    def stop(self):
+        self.stopped.set()
+
+    @staticmethod
+    def _timed(name: str, job, *args):
+        start = time.monotonic()
+        try:
+            return job(*args)
+        finally:
+            TICK_DURATION.observe(time.monotonic() - start, job=name)
+
+    def _poll(self, due: list, running: dict) -> dict:
+        """ Start the jobs of the due sources, returns the result or exception per source name
+
+            With a Supervisor the jobs are added to `running` and only those that could not
+            be started are returned, otherwise they run one after the other.
+        """
+
+        if self.supervisor is not None:
+            return self.supervisor.start(
+                [(schedule.name, self._timed, (schedule.name, job) + args) for schedule, job, args in due], running)
+
+        results = {}
+        for schedule, job, args in due:
+            try:
+                results[schedule.name] = self._timed(schedule.name, job, *args)
+            except Exception as err:
+                results[schedule.name] = err
+        return results
+
+    def _plan(self, schedule: SourceSchedule, source_time):
+        if isinstance(source_time, Exception):
+            logging.error(f"Polling {schedule.name} failed: {source_time!r}")
+            source_time = None
+        if source_time is None:
+            delay = schedule.failed()
+            logging.warning(f"{schedule.name}: no data, retrying in {delay:.0f} sec")
+            return
+        if schedule.observe(source_time) and self.save is not None:
+            self.save(schedule.name, schedule.state())
+        logging.info(f"{schedule.name}: next poll in {schedule.next_poll - time.time():.0f} sec")
+
+    def run(self):
+        """ Poll the sources until stop() is called """
+
+        schedules = {schedule.name: schedule for schedule, _, _ in self.sources}
+        # name -> future of the sources being polled
+        running = {}
+        while not self.stopped.is_set():
+            now = time.time()
+            due = [(schedule, job, args) for schedule, job, args in self.sources
+                   if schedule.next_poll <= now and schedule.name not in running]
+            for schedule, _, _ in due:
+                SCHEDULER_LAG.observe(now - schedule.next_poll)
+            results = self._poll(due, running) if due else {}
+
+            next_poll = min((schedule.next_poll for name, schedule in schedules.items() if name not in running),
+                            default=time.time() + 60)
+            if not results and running:
+                results = self.supervisor.wait(running, max(0.0, next_poll - time.time()))
+            elif not results:
+                self.stopped.wait(max(0.0, next_poll - time.time()))
+
+            for name, result in results.items():
+                self._plan(schedules[name], result)
+            if results and self.after is not None:
+                try:
+                    self.after()
+                except Exception:
+                    logging.exception("Job after polling failed")
@@ -0,0 +1,372 @@
+""" Data sources of the data-fetcher
+
+    Every source is a plugin registered under its name with @register. It declares the
+    measurement it writes (its schema), the shortest interval it is polled at and a parser
+    that turns the fetched response into points. Enabled sources (SOURCES) run concurrently
+    and put their points into one shared Batch, which is stored whenever a poll ended, so a
+    new or slow source does not lengthen the cycle of the others.
+
+    A source that needs the result of another one names it in `after` and runs right after
+    it in the same job: the RKI key data is only fetched when the RKI status date changed.
+"""
+import datetime
+import logging
+from threading import Lock
+import time
+
+from fetch import WEATHER_FIELDS
+from points import Schema
+
+AIR_QUALITY_FIELDS = ['aqi', 'co', 'no', 'no2', 'o3', 'so2', 'pm2_5', 'pm10', 'nh3']
+
+SOURCES = {}
+
+
+def register(cls):
+    """ Class decorator making a Source available under its name """
+
+    SOURCES[cls.name] = cls
+    return cls
+
+
+class Batch:
+    """ Points of all sources polled in one round, handed to store() together
+
+        Points of sources that do not go through the change filter (see Source.changes_only)
+        are kept apart and stored with dedup=False.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.points = []
+        self.unfiltered = []
+        self.lock = Lock()
+
+    def add(self, datapoints: list, changes_only: bool = True):
+        with self.lock:
+            (self.points if changes_only else self.unfiltered).extend(datapoints)
+
+    def flush(self) -> int:
+        """ Store the collected points, returns their number """
+
+        with self.lock:
+            points, self.points = self.points, []
+            unfiltered, self.unfiltered = self.unfiltered, []
+        if points:
+            self.store(points)
+        if unfiltered:
+            self.store(unfiltered, dedup=False)
+
+        return len(points) + len(unfiltered)
+
+
+class Source:
+    """ Base class of a data source
+
+        poll() fetches, parses and adds the points to the batch. It returns the timestamp
+        (epoch seconds) of the newest upstream data, from which the adaptive scheduler learns
+        the update interval of the source. `upstream` is what the source in `after` returned.
+    """
+
+    name = None
+    # shortest seconds between two polls, SAMPLING_TIME if it is longer
+    interval = 0
+    # name of a source this one runs after, e.g. a status check
+    after = None
+    # False for sources whose points are not a time series of changes, e.g. forecasts
+    changes_only = True
+
+    def __init__(self, config: dict, fetcher, cache):
+        self.config = config
+        self.fetcher = fetcher
+        self.cache = cache
+        self.schema = None
+
+    @property
+    def measurement(self) -> str:
+        return self.schema.measurement if self.schema is not None else None
+
+    def fetch(self, upstream=None):
+        raise NotImplementedError
+
+    def parse(self, response) -> tuple:
+        """ (datapoints, source time) of a fetched response """
+
+        raise NotImplementedError
+
+    def poll(self, batch: Batch, upstream=None):
+        datapoints, source_time = self.parse(self.fetch(upstream))
+        if datapoints:
+            batch.add(datapoints, self.changes_only)
+            logging.info(f"{self.name}: {len(datapoints)} points")
+
+        return source_time
+
+
+@register
+class WeatherSource(Source):
+    """ Current weather of all locations (openweathermap) """
+
+    name = 'weather'
+
+    def __init__(self, config: dict, fetcher, cache):
+        super().__init__(config, fetcher, cache)
+        self.schema = fetcher.schema_weather
+
+    def fetch(self, upstream=None):
+        logging.info(f"Fetching weather data for {len(self.config['locations'])} locations from openweathermap API")
+        return self.fetcher.get_weather()
+
+    def parse(self, response) -> tuple:
+        # without any result the poll failed, the scheduler backs off instead of seeing unchanged data
+        if not response:
+            return [], None
+        return self.fetcher.weather_datapoints(response), self.fetcher.weather_source_time
+
+
+@register
+class ForecastSource(Source):
+    """ 5 day / 3 hour weather forecast of all locations, timestamped with the forecast time
+
+        A new forecast overwrites the points of the last one at the same times.
+    """
+
+    name = 'forecast'
+    interval = 3 * 3600
+    changes_only = False
+
+    def __init__(self, config: dict, fetcher, cache):
+        super().__init__(config, fetcher, cache)
+        self.schema = Schema(f"{config['influxdb']['table_weather']}_forecast", ['runNum', 'location'], WEATHER_FIELDS)
+
+    def fetch(self, upstream=None):
+        return self.fetcher.get_locations('forecast')
+
+    def parse(self, response) -> tuple:
+        datapoints = []
+        source_time = None
+        for location, result in response:
+            forecast = result.get('list', [])
+            if forecast:
+                # the first forecast time moves on with every new forecast
+                source_time = max(source_time or 0, forecast[0]['dt'])
+            datapoints.extend(
+                self.schema.point((self.fetcher.runNo, location['name']), wetter_daten['dt'] * 10 ** 9,
+                                  self.fetcher.weather_fields(wetter_daten))
+                for wetter_daten in forecast)
+
+        return datapoints, source_time
+
+
+@register
+class AirQualitySource(Source):
+    """ Air quality index and pollutant concentrations (μg/m3) of all locations """
+
+    name = 'air_quality'
+    interval = 3600
+
+    def __init__(self, config: dict, fetcher, cache):
+        super().__init__(config, fetcher, cache)
+        self.schema = Schema(f"{config['influxdb']['table_weather']}_air", ['runNum', 'location'], AIR_QUALITY_FIELDS)
+
+    def fetch(self, upstream=None):
+        return self.fetcher.get_locations('air_quality')
+
+    def parse(self, response) -> tuple:
+        datapoints = []
+        source_time = None
+        for location, result in response:
+            for luft_daten in result.get('list', []):
+                source_time = max(source_time or 0, luft_daten['dt'])
+                components = luft_daten.get('components', {})
+                values = (luft_daten['main']['aqi'],) + tuple(components.get(field) for field in AIR_QUALITY_FIELDS[1:])
+                datapoints.append(self.schema.point((self.fetcher.runNo, location['name']), luft_daten['dt'] * 10 ** 9,
+                                                    values))
+
+        return datapoints, source_time
+
+
+@register
+class RkiStatusSource(Source):
+    """ Date of the latest RKI data, sources running after it get it as `upstream` """
+
+    name = 'rki_status'
+
+    def fetch(self, upstream=None):
+        return self.fetcher.check_status_api()
+
+    def parse(self, response) -> tuple:
+        return [], datetime.datetime.strptime(response, '%Y-%m-%d').timestamp()
+
+
+@register
+class RkiKeyDataSource(Source):
+    """ RKI key data of Bochum, or of all districts and states in bulk mode (RKI_BULK)
+
+        Runs after rki_status and is skipped while the status date is the one already stored.
+        Without rki_status it relies on the conditional requests of the Fetcher.
+    """
+
+    name = 'rki_key_data'
+    after = 'rki_status'
+
+    def __init__(self, config: dict, fetcher, cache):
+        super().__init__(config, fetcher, cache)
+        self.schema = fetcher.schema_rki_bulk if config['rki']['bulk'] else fetcher.schema_rki
+
+    def _remember(self, date_rki: str, **values):
+        if date_rki is not None:
+            values['rki_status_date'] = date_rki
+        self.cache.update(**values)
+
+    def poll(self, batch: Batch, upstream=None):
+        date_rki = datetime.datetime.fromtimestamp(upstream).strftime('%Y-%m-%d') if upstream is not None else None
+        # without rki_status there is no source time to learn from, a poll counts as new data
+        source_time = upstream if upstream is not None else time.time()
+        if date_rki is not None and date_rki == self.cache.get('rki_status_date'):
+            logging.info("Corona data is up to date!")
+            return source_time
+
+        if self.config['rki']['bulk']:
+            logging.info("Fetching Corona data for all districts from RKI API")
+            count = 0
+            for data_rki in self.fetcher.iter_datapoints_rki_bulk():
+                batch.add(data_rki)
+                count += len(data_rki)
+            logging.info(f"Queued Corona data for {count} administrative units")
+            self._remember(date_rki)
+            return source_time
+
+        data_rki = self.fetcher.prepare_datapoints_rki()
+        if not data_rki:
+            logging.info("Corona key data not modified upstream")
+            self._remember(date_rki)
+            return source_time
+
+        # without a cached ObjectId (cold start) the point is stored, the change filter drops it if it is known
+        rki_object_id = data_rki[0].fields['ObjectId']
+        if rki_object_id != self.cache.get('rki_object_id'):
+            logging.info(f"object_id: {rki_object_id} not found in database")
+            logging.info("Fetching Corona data from RKI API")
+            batch.add(data_rki)
+        else:
+            logging.info("Corona data is up to date!")
+        self._remember(date_rki, rki_object_id=rki_object_id)
+
+        return source_time
+
+
+def create_sources(config: dict, fetcher, cache) -> list:
+    """ The sources named in config['general']['sources'] """
+
+    sources = []
+    for name in config['general']['sources']:
+        if name not in SOURCES:
+            raise RuntimeError(f"Unknown source '{name}', available are {', '.join(sorted(SOURCES))}")
+        sources.append(SOURCES[name](config, fetcher, cache))
+
+    return sources
+
+
+def chain_sources(sources: list) -> list:
+    """ Group the sources into chains run as one job each, a source follows the one in its `after` """
+
+    names = {source.name for source in sources}
+    chains = []
+    by_name = {}
+    # sources without an enabled `after` start the chains
+    for source in sorted(sources, key=lambda source: source.after in names):
+        chain = by_name.get(source.after)
+        if chain is None:
+            chain = []
+            chains.append(chain)
+        chain.append(source)
+        by_name[source.name] = chain
+
+    return chains
+
+
+def chain_interval(chain: list, sampling_time: float) -> float:
+    return max([sampling_time] + [source.interval for source in chain])
+
+
+def poll_chain(chain: list, batch: Batch):
+    """ Poll the sources of a chain one after the other, returns the source time of the first """
+
+    source_time = upstream = chain[0].poll(batch)
+    for source in chain[1:]:
+        upstream = source.poll(batch, upstream)
+
+    return source_time
+
+
+class SourceRunner:
+    """ Polls the chains of sources that are due concurrently and stores their points
+
+        Used on the fixed sampling period, a source is polled again once its interval passed.
+        With a Supervisor the points of a chain are stored as soon as it ended. A run waits
+        for slow chains at most WAIT_FRACTION of the sampling period, then they are left
+        running and collected by a later run while the other chains are polled as usual.
+    """
+
+    WAIT_FRACTION = 0.5
+
+    def __init__(self, sources: list, store, sampling_time: float, supervisor=None):
+        self.chains = chain_sources(sources)
+        self.batch = Batch(store)
+        self.sampling_time = sampling_time
+        self.supervisor = supervisor
+        self.last_poll = {}
+        # name -> future of the chains being polled
+        self.running = {}
+
+    def jobs(self, now: float = None) -> list:
+        """ (name, job, args) of the chains that are due """
+
+        now = now or time.monotonic()
+        jobs = []
+        for chain in self.chains:
+            name = chain[0].name
+            if name in self.running:
+                continue
+            last_poll = self.last_poll.get(name)
+            # a little slack, ticks are not exactly sampling_time apart
+            if last_poll is None or now - last_poll >= chain_interval(chain, self.sampling_time) - 1:
+                self.last_poll[name] = now
+                jobs.append((name, poll_chain, (chain, self.batch)))
+
+        return jobs
+
+    def run(self) -> dict:
+        """ Poll the due sources, returns the result or exception per chain that ended """
+
+        jobs = self.jobs()
+        if self.supervisor is None:
+            results = {}
+            for name, job, args in jobs:
+                try:
+                    results[name] = job(*args)
+                except Exception as err:
+                    results[name] = err
+            self._ended(results)
+            return results
+
+        results = self.supervisor.start(jobs, self.running)
+        self._ended(results)
+        end = time.monotonic() + self.sampling_time * self.WAIT_FRACTION
+        while self.running:
+            ended = self.supervisor.wait(self.running, max(0.0, end - time.monotonic()))
+            self._ended(ended)
+            results.update(ended)
+            if time.monotonic() >= end:
+                break
+
+        return results
+
+    def _ended(self, results: dict):
+        """ Log the failed chains and store the points of the ended ones """
+
+        for name, result in results.items():
+            if isinstance(result, Exception):
+                logging.error(f"Fetching {name} data failed: {result!r}")
+        self.batch.flush()
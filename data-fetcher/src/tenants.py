@@ -0,0 +1,124 @@
+""" Fan-out of fetched points to the influxdb targets of several profiles
+
+    Every upstream resource is fetched once for all profiles (see config.load_profiles).
+    A Tenant picks the points meant for its profile, i.e. those of its locations and all
+    RKI points, renames the measurements to its own table names and queues them in its
+    own Database, which batches and retries its writes independently of the others.
+"""
+import logging
+import re
+
+from db import Database
+from points import Point, Schema
+from query import quote_ident
+
+# quoted measurement of a statement, with its retention policy if any: FROM "policy"."measurement"
+MEASUREMENT = re.compile(r'(FROM (?:"(?:[^"\\]|\\.)*"\.)?)"((?:[^"\\]|\\.)*)"')
+
+
+class Tenant:
+    """ One profile: its Database, the names of its locations and its table names """
+
+    def __init__(self, name: str, database: Database, locations: list, tables: dict):
+        self.name = name
+        self.database = database
+        self.locations = set(locations)
+        # canonical table name -> own table name, longest first so prefixes match exactly
+        self.tables = sorted(tables.items(), key=lambda item: -len(item[0]))
+        self.schemas = {}
+
+    def _rename(self, measurement: str) -> str:
+        for canonical, own in self.tables:
+            # derived measurements keep their suffix, e.g. wetter_forecast
+            if measurement == canonical or measurement.startswith(f'{canonical}_'):
+                return own + measurement[len(canonical):]
+        return measurement
+
+    def _schema(self, schema: Schema) -> tuple:
+        """ (own schema, index of the location tag or None) of a fetched schema """
+
+        mapped = self.schemas.get(schema)
+        if mapped is None:
+            measurement = self._rename(schema.measurement)
+            own = schema if measurement == schema.measurement else \
+                Schema(measurement, schema.tag_keys, schema.field_keys)
+            location = schema.tag_keys.index('location') if 'location' in schema.tag_keys else None
+            mapped = self.schemas[schema] = (own, location)
+        return mapped
+
+    def own_statement(self, statement: str) -> str:
+        """ The statement with the measurement names of this profile """
+
+        def rename(match):
+            own = self._rename(match[2])
+            return match[0] if own == match[2] else f'{match[1]}{quote_ident(own)}'
+
+        return MEASUREMENT.sub(rename, statement)
+
+    def select(self, datapoints: list) -> list:
+        """ The points of this profile, with its own measurement names """
+
+        selected = []
+        for point in datapoints:
+            schema, location = self._schema(point.schema)
+            if location is not None and point.tag_values[location] not in self.locations:
+                continue
+            selected.append(point if schema is point.schema else
+                            Point(schema, point.tag_values, point.time, point.field_values))
+
+        return selected
+
+
+class FanOut:
+    """ Stands in for a Database and hands every batch of points to all tenants
+
+        Reads (query) go to the database of the first profile, with its measurement names.
+    """
+
+    def __init__(self, tenants: list):
+        self.tenants = tenants
+
+    def save_to_database(self, data: list, be_verbose: bool):
+        for tenant in self.tenants:
+            datapoints = tenant.select(data)
+            if datapoints:
+                tenant.database.save_to_database(datapoints, be_verbose)
+
+    def query(self, statement: str, **kwargs):
+        tenant = self.tenants[0]
+        return tenant.database.query(tenant.own_statement(statement), **kwargs)
+
+    def flush(self, timeout: float = None) -> bool:
+        return all([tenant.database.flush(timeout) for tenant in self.tenants])
+
+    def close(self):
+        for tenant in self.tenants:
+            tenant.database.close()
+
+
+def create_database(config: dict):
+    """ Database of the config, or a FanOut to the databases of all profiles if there are any """
+
+    if not config['profiles']:
+        return Database(config['influxdb'])
+
+    canonical = config['influxdb']
+    tenants = []
+    for profile in config['profiles']:
+        influxdb = profile['influxdb']
+        tables = {canonical[key]: influxdb[key] for key in ('table_weather', 'table_rki')}
+        tenants.append(Tenant(profile['name'], Database(influxdb), profile['locations'], tables))
+        logging.info(f"Profile '{profile['name']}': {len(profile['locations'])} locations, "
+                     f"influxdb {influxdb['host']}:{influxdb['port']}/{influxdb['dbname']}")
+
+    return FanOut(tenants)
+
+
+def targets(config: dict, database) -> list:
+    """ (Database, config) of every influxdb target, for work done in each of them like rollups """
+
+    if isinstance(database, FanOut):
+        return [(tenant.database, dict(config, influxdb=profile['influxdb']))
+                for tenant, profile in zip(database.tenants, config['profiles'])]
+
+    return [(database, config)]
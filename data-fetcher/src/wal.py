@@ -0,0 +1,233 @@
+import fcntl
+import logging
+import sqlite3
+from threading import Condition, Thread
+import time
+
+from metrics import BATCH_SIZE, RETRIES, WRITE_POINTS_DROPPED
+from points import LineEncoder
+
+
+class WriteAheadLog:
+    """ Durable write queue of a Database, used instead of the WriteBuffer when WAL_DIR is set
+
+        Queued points are encoded to line protocol and appended to a SQLite file (journal mode
+        WAL) before anything is sent, so points fetched while influxdb is down or right before
+        a crash are not lost. Appending never waits for influxdb. A background thread drains
+        the log in order, in batches of up to `batch_size` points, and deletes a batch once
+        influxdb accepted it. After an outage the backlog is replayed at one request per batch.
+
+        Commits use synchronous=NORMAL: a crash of the process loses nothing, a power loss at
+        most the appends since the last checkpoint, and the fsyncs are batched by the checkpoints
+        instead of slowing down every append. The log holds at most `max_points` points, beyond
+        that the oldest ones are dropped.
+
+        A log is used by one process at a time, it holds an exclusive lock on `<path>.lock`
+        and raises a RuntimeError when another process has it. The number of logged points
+        is always read from the log itself.
+    """
+
+    def __init__(self, write, path: str, batch_size: int = 5000, flush_interval: float = 10.0,
+                 max_points: int = 2000000, retry_interval: float = 5.0, max_retry_interval: float = 300.0):
+        self.write = write
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_points = max_points
+        self.retry_interval = retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.encoder = LineEncoder()
+        self.condition = Condition()
+        # two processes draining one log would write every batch twice
+        self.lock_file = open(f'{path}.lock', 'w')
+        try:
+            fcntl.flock(self.lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            self.lock_file.close()
+            raise RuntimeError(f"Write-ahead log '{path}' is used by another process")
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS queued_lines (id INTEGER PRIMARY KEY, lines TEXT NOT NULL, points INTEGER NOT NULL)")
+        # the number of logged points, kept in step with the rows by triggers
+        self.connection.execute("CREATE TABLE IF NOT EXISTS queued_points (points INTEGER NOT NULL)")
+        self.connection.execute(
+            "INSERT INTO queued_points SELECT COALESCE(SUM(points), 0) FROM queued_lines "
+            "WHERE NOT EXISTS (SELECT 1 FROM queued_points)")
+        self.connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS queued_lines_insert AFTER INSERT ON queued_lines "
+            "BEGIN UPDATE queued_points SET points = points + NEW.points; END")
+        self.connection.execute(
+            "CREATE TRIGGER IF NOT EXISTS queued_lines_delete AFTER DELETE ON queued_lines "
+            "BEGIN UPDATE queued_points SET points = points - OLD.points; END")
+        self.connection.commit()
+        points = self.pending()
+        if points:
+            logging.info(f"Replaying {points} points left in write-ahead log '{path}'")
+        self.flush_requested = False
+        # number of flush() calls, each one ends the wait for a retry once
+        self.flushes = 0
+        self.stopping = False
+        self.thread = Thread(target=self._run, name='influxdb-wal-writer', daemon=True)
+        self.thread.start()
+
+    def add(self, datapoints: list):
+        """ Append datapoints to the log, returns without waiting for influxdb """
+
+        with self.condition:
+            # rows of at most batch_size points, so the batches can be cut at rows
+            for start in range(0, len(datapoints), self.batch_size):
+                lines = self.encoder.encode(datapoints[start:start + self.batch_size])
+                if not lines:
+                    continue
+                count = lines.count('\n') + 1
+                self.connection.execute("INSERT INTO queued_lines (lines, points) VALUES (?, ?)", (lines, count))
+            points = self.pending()
+            if points > self.max_points:
+                self._drop_oldest(points)
+            self.connection.commit()
+            if points >= self.batch_size:
+                self.condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """ Write all logged points now and wait until they are written """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            self.flush_requested = True
+            self.flushes += 1
+            self.condition.notify_all()
+            while self.pending():
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+
+        return True
+
+    def close(self, timeout: float = 30.0):
+        """ Write remaining points if influxdb is reachable and stop the background thread
+
+            Points that could not be written stay in the log and are replayed by the next start.
+        """
+
+        if not self.flush(timeout):
+            logging.warning(f"{self.pending()} points kept in write-ahead log '{self.path}' for the next start")
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+        with self.condition:
+            self.connection.close()
+            self.lock_file.close()
+
+    def pending(self) -> int:
+        """ Number of logged points not written yet """
+
+        with self.condition:
+            return self.connection.execute("SELECT points FROM queued_points").fetchone()[0]
+
+    def _delete(self, last_id: int) -> int:
+        """ Delete the rows up to last_id, returns the number of their points """
+
+        count = self.connection.execute(
+            "SELECT COALESCE(SUM(points), 0) FROM queued_lines WHERE id <= ?", (last_id,)).fetchone()[0]
+        self.connection.execute("DELETE FROM queued_lines WHERE id <= ?", (last_id,))
+
+        return count
+
+    def _drop_oldest(self, points: int):
+        excess = points - self.max_points
+        last_id = None
+        dropped = 0
+        cursor = self.connection.execute("SELECT id, points FROM queued_lines ORDER BY id")
+        for row_id, count in cursor:
+            if dropped >= excess:
+                break
+            last_id = row_id
+            dropped += count
+        cursor.close()
+        dropped = self._delete(last_id)
+        WRITE_POINTS_DROPPED.inc(dropped, reason='full')
+        logging.warning(f"Write-ahead log full ({self.max_points} points), dropped the oldest {dropped} points")
+
+    def _next_batch(self, wait: bool = True) -> tuple:
+        """ (id of the last row, line protocol, number of points) of the oldest logged points """
+
+        with self.condition:
+            deadline = time.monotonic() + self.flush_interval
+            while wait and not self.stopping and not self.flush_requested and self.pending() < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+
+            last_id = None
+            batch = []
+            count = 0
+            cursor = self.connection.execute("SELECT id, lines, points FROM queued_lines ORDER BY id")
+            for row_id, lines, points in cursor:
+                if batch and count + points > self.batch_size:
+                    break
+                last_id = row_id
+                batch.append(lines)
+                count += points
+            cursor.close()
+            if not batch:
+                # nothing logged, a flush is done and the thread waits for new points
+                self.flush_requested = False
+                self.condition.notify_all()
+                if wait and not self.stopping:
+                    self.condition.wait(self.flush_interval)
+
+        return last_id, '\n'.join(batch), count
+
+    def _written(self, last_id: int):
+        with self.condition:
+            self._delete(last_id)
+            self.connection.commit()
+            if not self.pending():
+                self.flush_requested = False
+            self.condition.notify_all()
+
+    def _wait(self, seconds: float) -> bool:
+        """ Sleep before a retry, a flush retries at once. True when stopping """
+
+        with self.condition:
+            flushes = self.flushes
+            self.condition.wait_for(lambda: self.stopping or self.flushes != flushes, seconds)
+            return self.stopping
+
+    def _run(self):
+        # imported by the writer thread, it starts with the first write
+        from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+        from requests.exceptions import RequestException
+
+        retry_interval = self.retry_interval
+        failed = False
+        while not self.stopping:
+            # after a failed write the same batch is retried without waiting for more points
+            last_id, lines, count = self._next_batch(wait=not failed)
+            if not count:
+                failed = False
+                continue
+            try:
+                BATCH_SIZE.observe(count)
+                self.write(lines)
+                logging.info(f"Wrote batch of {count} points to influxdb, {self.pending() - count} left in the log")
+            except (InfluxDBClientError, InfluxDBServerError, RequestException) as err:
+                if not isinstance(err, InfluxDBClientError) or err.code != 400:
+                    logging.error(f"Writing batch of {count} points failed, retrying in {retry_interval:g}s: {err}")
+                    RETRIES.inc(component='influxdb_write')
+                    failed = True
+                    if self._wait(retry_interval):
+                        return
+                    retry_interval = min(retry_interval * 2, self.max_retry_interval)
+                    continue
+                # malformed lines would block the log for good, influxdb wrote the valid ones of the batch
+                logging.error(f"influxdb rejected lines of a batch of {count} points, dropping it: {err}")
+                WRITE_POINTS_DROPPED.inc(count, reason='rejected')
+            self._written(last_id)
+            failed = False
+            retry_interval = self.retry_interval
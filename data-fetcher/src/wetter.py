@@ -0,0 +1,125 @@
+""" Single entry point for all services of the data-fetcher
+
+        python3 -m wetter run fetcher
+        python3 -m wetter run notifier
+        python3 -m wetter run fetcher notifier
+        python3 -m wetter run backfill --start 2021-03-01 --end 2021-04-01
+
+    Only the modules of the started service are imported, the heavy dependencies (influxdb,
+    requests, aiohttp, numpy, smtplib) are imported by the code using them on first use.
+    Several services are started from one process: the modules they share are imported
+    once, then one child process per service is forked, so the children share those pages
+    instead of every service loading them in its own interpreter. Every child serves its
+    own metrics, the n-th service on METRICS_PORT + n (the fetcher on METRICS_PORT).
+"""
+import argparse
+import gc
+import importlib
+import logging
+import os
+import signal
+import sys
+
+# service name -> module with its main()
+SERVICES = {
+    'fetcher': 'app',
+    'notifier': 'notifier',
+    'backfill': 'backfill',
+    'export': 'export'
+}
+# imported before forking, every long running service needs them
+PRELOAD = ['influxdb', 'requests']
+
+
+def run(service: str, args: list = ()) -> int:
+    """ Run the main() of a service in this process, returns its exit code """
+
+    module = importlib.import_module(SERVICES[service])
+    sys.argv = [f'wetter {service}'] + list(args)
+    try:
+        module.main()
+    except SystemExit as stopped:
+        return stopped.code if isinstance(stopped.code, int) else (0 if stopped.code is None else 1)
+    return 0
+
+
+def fork(services: list) -> int:
+    """ Run every service in a forked child, returns the exit code of the first one that ends
+
+        The others are stopped then, so the container is restarted as a whole.
+    """
+
+    from dotenv import load_dotenv
+
+    # the metrics of a child are only in its own registry, so every child needs a port of its own
+    load_dotenv()
+    metrics_port = int(os.getenv('METRICS_PORT') or 0)
+    for name in PRELOAD + [SERVICES[service] for service in services]:
+        importlib.import_module(name)
+    # objects created so far are never collected, so the collector does not touch (and copy) their pages
+    gc.freeze()
+
+    children = {}
+    for index, service in enumerate(services):
+        pid = os.fork()
+        if pid == 0:
+            # a stopped child closes its service, e.g. writes the queued points
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            if metrics_port:
+                os.environ['METRICS_PORT'] = str(metrics_port + index)
+            os._exit(run(service))
+        children[pid] = service
+        logging.info(f"Started {service} (pid {pid})"
+                     + (f", metrics on port {metrics_port + index}" if metrics_port else ""))
+
+    stopping = []
+
+    def stop(signum, frame):
+        stopping.append(signum)
+        for child in children:
+            os.kill(child, signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    pid, status = os.wait()
+    code = os.waitstatus_to_exitcode(status)
+    logging.info(f"{children.pop(pid)} exited with {code}")
+    for child in children:
+        os.kill(child, signal.SIGTERM)
+    for child in children:
+        os.waitpid(child, 0)
+
+    return 0 if stopping else code
+
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s %(levelname)s %(message)s',
+        datefmt='[%Y-%m-%d %H:%M:%S]',
+        level=logging.INFO)
+
+    parser = argparse.ArgumentParser(prog='wetter', description="Weather and corona data services")
+    commands = parser.add_subparsers(dest='command', required=True)
+    command = commands.add_parser('run', help="run one or more services")
+    command.add_argument('services', nargs='+', metavar='service',
+                         help=f"{', '.join(SERVICES)}, followed by the arguments of backfill/export")
+    # everything after the service names belongs to the service, e.g. `run backfill --help`
+    argv = sys.argv[1:]
+    count = min(len(argv), 2)
+    while count < len(argv) and argv[count] in SERVICES:
+        count += 1
+    args = parser.parse_args(argv[:count])
+    services, arguments = args.services, argv[count:]
+
+    if any(service not in SERVICES for service in services):
+        parser.error(f"unknown service, available are {', '.join(SERVICES)}")
+    if len(services) == 1:
+        sys.exit(run(services[0], arguments))
+    if arguments or set(services) - {'fetcher', 'notifier'}:
+        parser.error("several services can only be fetcher and notifier, without arguments")
+    sys.exit(fork(services))
+
+
+if __name__ == '__main__':
+    main()
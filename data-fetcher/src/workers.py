@@ -0,0 +1,124 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import logging
+from threading import Lock, local
+import time
+
+from metrics import JOB_TIMEOUTS
+
+_current = local()
+
+
+class JobCancelled(RuntimeError):
+    """ Raised inside a supervised job once its deadline has passed """
+
+
+def check_cancelled():
+    """ Stop the calling job if it runs supervised and its deadline has passed
+
+        Long running jobs call this between requests (e.g. between pages), so a job that
+        was given up by the supervisor ends at the next request instead of running on.
+    """
+
+    deadline = getattr(_current, 'deadline', None)
+    if deadline is not None and time.monotonic() > deadline:
+        raise JobCancelled("Deadline of the job has passed")
+
+
+def remaining_time():
+    """ Seconds left until the deadline of the calling job, None if it does not run supervised """
+
+    deadline = getattr(_current, 'deadline', None)
+    return None if deadline is None else max(0.0, deadline - time.monotonic())
+
+
+class Supervisor:
+    """ Runs fetch jobs on a bounded thread pool with a deadline per job
+
+        At most max_workers jobs are in flight, and a job is not started again while its
+        previous run is still going, so a hanging API cannot pile up threads. A caller hands
+        the jobs it started to wait(), which returns as soon as one of them ends, so a slow job
+        does not hold back the others, and gives a job up after `deadline` seconds. Jobs that
+        are given up notice it through
+        check_cancelled() and end at the latest with the connect/read timeout of their request.
+        Concurrent requests (AsyncFetchEngine.get_many) are cancelled at the deadline itself.
+    """
+
+    def __init__(self, max_workers: int = 4, deadline: float = 120):
+        self.deadline = deadline
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix='fetch-job')
+        self.running = {}
+        self.deadlines = {}
+        self.lock = Lock()
+
+    @staticmethod
+    def _call(deadline: float, job, args):
+        _current.deadline = deadline
+        try:
+            return job(*args)
+        finally:
+            _current.deadline = None
+
+    def submit(self, name: str, job, *args):
+        """ Start a job, returns its future or None if its previous run has not finished yet """
+
+        with self.lock:
+            running = self.running.get(name)
+            if running is not None and not running.done():
+                return None
+            deadline = time.monotonic() + self.deadline
+            future = self.executor.submit(self._call, deadline, job, args)
+            self.running[name] = future
+            self.deadlines[name] = deadline
+        return future
+
+    def start(self, jobs: list, running: dict) -> dict:
+        """ Submit (name, job, args) tuples and add their futures to `running` by name
+
+            Returns a RuntimeError per job that was not started as its previous run is still going.
+        """
+
+        results = {}
+        for name, job, args in jobs:
+            future = self.submit(name, job, *args)
+            if future is None:
+                results[name] = RuntimeError(f"{name}: previous run is still in flight")
+            else:
+                running[name] = future
+        return results
+
+    def wait(self, running: dict, timeout: float = None) -> dict:
+        """ Wait until one of the `running` jobs ends or passes its deadline, at most `timeout` seconds
+
+            The jobs that ended are removed from `running`. Returns the result per name of those,
+            or the exception for jobs that failed or timed out, empty if none ended in time.
+        """
+
+        with self.lock:
+            deadlines = {name: self.deadlines[name] for name in running}
+        limit = min(deadlines.values(), default=time.monotonic()) - time.monotonic()
+        if timeout is not None:
+            limit = min(limit, timeout)
+        wait(list(running.values()), max(0.0, limit), return_when=FIRST_COMPLETED)
+
+        results = {}
+        now = time.monotonic()
+        for name, future in list(running.items()):
+            if future.done():
+                try:
+                    results[name] = future.result()
+                except Exception as err:
+                    results[name] = err
+            elif now >= deadlines[name]:
+                future.cancel()
+                JOB_TIMEOUTS.inc(job=name)
+                results[name] = TimeoutError(f"{name} did not finish within {self.deadline} sec")
+            else:
+                continue
+            del running[name]
+        return results
+
+    def close(self):
+        """ Stop accepting jobs, jobs still running are not waited for """
+
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        logging.info("Fetch workers stopped")
@@ -0,0 +1,138 @@
+from collections import deque
+import logging
+from threading import Condition, Thread
+import time
+
+from metrics import BATCH_SIZE, RETRIES, WRITE_POINTS_DROPPED
+from points import LineEncoder
+
+
+class WriteBuffer:
+    """ Collects datapoints from all fetch sources and writes them to influxdb in large batches
+
+        Points are queued by the calling thread as they are and converted to line protocol by
+        a background thread, which hands them to `write` once `batch_size` points are queued
+        or `flush_interval` seconds have passed. The queue holds at most `max_points` points,
+        callers block in `add` while it is full (backpressure).
+    """
+
+    def __init__(self, write, batch_size: int = 5000, flush_interval: float = 10.0,
+                 max_points: int = 50000, retry_interval: float = 5.0):
+        self.write = write
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_points = max_points
+        self.retry_interval = retry_interval
+        self.encoder = LineEncoder()
+        self.points = deque()
+        self.condition = Condition()
+        self.pending = 0
+        self.flush_requested = False
+        self.stopping = False
+        self.thread = Thread(target=self._run, name='influxdb-writer', daemon=True)
+        self.thread.start()
+
+    def add(self, datapoints: list, timeout: float = 30.0):
+        """ Queue datapoints for writing, blocks while the buffer is full """
+
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            for point in datapoints:
+                while len(self.points) >= self.max_points:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise RuntimeError(
+                            f"Write buffer full ({self.max_points} points), influxdb is not keeping up")
+                    self.condition.wait(remaining)
+                self.points.append(point)
+            if len(self.points) >= self.batch_size:
+                self.condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """ Write all queued points now and wait until they are written """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            self.flush_requested = True
+            self.condition.notify_all()
+            while self.points or self.pending:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.condition.wait(remaining)
+
+        return True
+
+    def close(self, timeout: float = 30.0):
+        """ Flush remaining points and stop the background thread """
+
+        self.flush(timeout)
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join(timeout)
+
+    def _next_batch(self) -> list:
+        with self.condition:
+            deadline = time.monotonic() + self.flush_interval
+            while not self.stopping and not self.flush_requested and len(self.points) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            count = min(self.batch_size, len(self.points))
+            batch = [self.points.popleft() for _ in range(count)]
+            self.pending = len(batch)
+            if not self.points:
+                self.flush_requested = False
+            self.condition.notify_all()
+
+        return batch
+
+    def _requeue(self, batch: list):
+        with self.condition:
+            self.points.extendleft(reversed(batch))
+            dropped = len(self.points) - self.max_points
+            for _ in range(dropped):
+                self.points.pop()
+            self.pending = 0
+            self.condition.notify_all()
+        if dropped > 0:
+            WRITE_POINTS_DROPPED.inc(dropped, reason='full')
+            logging.warning(f"Write buffer full ({self.max_points} points), dropped the newest {dropped} points")
+
+    def _done(self):
+        with self.condition:
+            self.pending = 0
+            self.condition.notify_all()
+
+    def _run(self):
+        # imported by the writer thread, it starts with the first write
+        from influxdb.exceptions import InfluxDBClientError, InfluxDBServerError
+        from requests.exceptions import RequestException
+
+        while True:
+            batch = self._next_batch()
+            if not batch:
+                if self.stopping:
+                    return
+                continue
+            try:
+                BATCH_SIZE.observe(len(batch))
+                lines = self.encoder.encode(batch)
+                self.write(lines)
+                logging.info(f"Wrote batch of {len(batch)} points to influxdb")
+                self._done()
+            except (InfluxDBClientError, InfluxDBServerError, RequestException) as err:
+                if isinstance(err, InfluxDBClientError) and err.code == 400:
+                    # malformed lines would be retried forever, influxdb wrote the valid ones of the batch
+                    logging.error(f"influxdb rejected lines of a batch of {len(batch)} points, dropping it: {err}")
+                    WRITE_POINTS_DROPPED.inc(len(batch), reason='rejected')
+                    self._done()
+                    continue
+                logging.error(f"Writing batch of {len(batch)} points failed: {err}")
+                RETRIES.inc(component='influxdb_write')
+                self._requeue(batch)
+                if self.stopping:
+                    return
+                time.sleep(self.retry_interval)
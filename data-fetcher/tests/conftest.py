@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules of the data-fetcher are flat in src, like they are imported when it runs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
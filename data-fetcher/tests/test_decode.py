@@ -0,0 +1,65 @@
+import json
+
+import pytest
+
+from decode import FeatureStream
+
+BODY = json.dumps({
+    'objectIdFieldName': 'ObjectId',
+    'features': [
+        {'attributes': {'GEN': 'Bochum', 'Inz7T': 123.456789, 'AnzFall': 12345}},
+        {'attributes': {'GEN': 'Mülheim an der Ruhr', 'Inz7T': -0.5e-3, 'AnzFall': 0}},
+        {'attributes': {'GEN': 'say "hi" \\ back\nslash/tab\t', 'Inz7T': None, 'AnzFall': True}},
+        {'geometry': None}
+    ],
+    'exceededTransferLimit': False
+}, ensure_ascii=False).encode()
+
+
+def parse(chunks: list) -> tuple:
+    stream = FeatureStream(chunks)
+    return list(stream), stream.meta
+
+
+def expected() -> tuple:
+    document = json.loads(BODY)
+    features = [feature.get('attributes', {}) for feature in document.pop('features')]
+    return features, document
+
+
+def test_whole_body():
+    assert parse([BODY]) == expected()
+
+
+def test_split_at_every_byte():
+    # splits inside keys, numbers, escapes and the two bytes of the umlaut
+    for split in range(1, len(BODY)):
+        assert parse([BODY[:split], BODY[split:]]) == expected(), split
+
+
+def test_one_byte_chunks():
+    assert parse([BODY[index:index + 1] for index in range(len(BODY))]) == expected()
+
+
+def test_unicode_escapes():
+    body = b'{"features": [{"attributes": {"GEN": "M\\u00fclheim \\ud83d\\ude00"}}]}'
+    for split in range(1, len(body)):
+        assert parse([body[:split], body[split:]])[0] == [{'GEN': 'Mülheim 😀'}]
+
+
+def test_empty_features_and_object():
+    assert parse([b'{"features": [], "error": {"code": 400}}']) == ([], {'error': {'code': 400}})
+    assert parse([b' { } ']) == ([], {})
+
+
+def test_truncated_input_raises():
+    for end in range(len(BODY)):
+        with pytest.raises(ValueError):
+            parse([BODY[:end]])
+
+
+def test_malformed_input_raises():
+    with pytest.raises(ValueError):
+        parse([b'{"features": [{"attributes": {}} {"attributes": {}}]}'])
+    with pytest.raises(ValueError):
+        parse([b'[]'])
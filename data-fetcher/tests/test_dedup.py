@@ -0,0 +1,57 @@
+from dedup import ChangeFilter
+from points import Schema
+
+SCHEMA = Schema('wetter', ('location',), ('temperatur', 'description'))
+SECOND = 10 ** 9
+
+
+def point(time: int, temperature: float, description: str = 'klar', location: str = 'Bochum'):
+    return SCHEMA.point((location,), time * SECOND, (temperature, description))
+
+
+def test_unchanged_points_are_dropped():
+    changes = ChangeFilter(deadbands={'temperatur': 0.1}, heartbeat=1800)
+
+    first = [point(0, 10.0), point(0, 10.0, location='Essen')]
+    assert changes.filter(first) == first
+    assert changes.filter([point(60, 10.05), point(60, 10.0, location='Essen')]) == []
+
+    changed = [point(120, 10.2), point(120, 10.0, 'Regen', 'Essen')]
+    assert changes.filter(changed) == changed
+
+
+def test_deadband_is_measured_from_the_last_written_value():
+    changes = ChangeFilter(deadbands={'temperatur': 0.1}, heartbeat=1800)
+    changes.filter([point(0, 10.0)])
+
+    # drifting in small steps is written once it moved beyond the deadband in total
+    assert changes.filter([point(60, 10.06)]) == []
+    assert len(changes.filter([point(120, 10.12)])) == 1
+
+
+def test_heartbeat_writes_unchanged_series():
+    changes = ChangeFilter(heartbeat=1800)
+    changes.filter([point(0, 10.0)])
+
+    assert changes.filter([point(1799, 10.0)]) == []
+    assert len(changes.filter([point(1800, 10.0)])) == 1
+
+
+def test_none_values_count_as_change():
+    changes = ChangeFilter(deadbands={'temperatur': 0.1})
+    changes.filter([point(0, 10.0)])
+
+    assert len(changes.filter([point(60, None)])) == 1
+    assert changes.filter([point(120, None)]) == []
+
+
+def test_last_writes_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'dedup.sqlite')
+    changes = ChangeFilter(path, {'temperatur': 0.1})
+    changes.filter([point(0, 10.0)])
+    changes.close()
+
+    changes = ChangeFilter(path, {'temperatur': 0.1})
+    assert changes.filter([point(60, 10.05)]) == []
+    assert len(changes.filter([point(120, 11.0)])) == 1
+    changes.close()
@@ -0,0 +1,34 @@
+from points import LineEncoder, Schema
+
+
+def test_encode_escapes_and_types():
+    schema = Schema('wetter data,x', ('location', 'runNum'), ('temperatur', 'count', 'ok', 'description'))
+    point = schema.point(('Bochum Süd,=', 1), 1600000000000000000, (12.5, 3, True, 'say "hi" \\'))
+
+    assert LineEncoder().encode([point]) == (
+        'wetter\\ data\\,x,location=Bochum\\ Süd\\,\\=,runNum=1 '
+        'temperatur=12.5,count=3i,ok=true,description="say \\"hi\\" \\\\" 1600000000000000000')
+
+
+def test_tags_are_sorted_and_empty_values_left_out():
+    schema = Schema('m', ('z', 'a', 'm'), ('f', 'g'))
+    lines = LineEncoder().encode([schema.point(('1', '', None), 5, (None, 1.0)),
+                                  schema.point(('2', 'x', 'y'), 5, (False, None))])
+
+    assert lines == 'm,z=1 g=1.0 5\nm,a=x,m=y,z=2 f=false 5'
+
+
+def test_points_without_fields_are_skipped():
+    schema = Schema('m', ('t',), ('f',))
+    lines = LineEncoder().encode([schema.point(('a',), 1, (None,)), schema.point(('b',), 2, (1.0,))])
+
+    assert lines == 'm,t=b f=1.0 2'
+    assert LineEncoder().encode([schema.point(('a',), 1, (None,))]) == ''
+
+
+def test_buffer_is_reused_between_batches():
+    schema = Schema('m', ('t',), ('f',))
+    encoder = LineEncoder()
+    encoder.encode([schema.point((str(index),), index, (1.0,)) for index in range(100)])
+
+    assert encoder.encode([schema.point(('x',), 7, (2.0,))]) == 'm,t=x f=2.0 7'
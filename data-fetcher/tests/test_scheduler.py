@@ -0,0 +1,101 @@
+from threading import Thread
+import time
+
+from scheduler import AdaptiveScheduler, SourceSchedule
+from workers import Supervisor
+
+NOW = 1600000000.0
+
+
+def test_learns_the_update_interval():
+    schedule = SourceSchedule('weather', 60, margin=30)
+    schedule.observe(NOW, NOW)
+    schedule.observe(NOW + 600, NOW + 610)
+
+    assert schedule.interval == 600
+    assert schedule.next_poll == NOW + 600 + 600 + 30
+
+    schedule.observe(NOW + 1300, NOW + 1310)
+    assert schedule.interval == 0.7 * 600 + 0.3 * 700
+
+
+def test_unchanged_source_is_polled_again_soon():
+    schedule = SourceSchedule('weather', 60, state={'interval': 600, 'source_time': NOW})
+    schedule.observe(NOW, NOW + 700)
+
+    assert schedule.next_poll == NOW + 700 + 60
+
+
+def test_restart_with_old_state_does_not_learn_the_downtime():
+    # cache.json of a day ago, the first poll after the start only records the source time
+    schedule = SourceSchedule('weather', 60, margin=30, state={'interval': 600, 'source_time': NOW - 86400})
+    schedule.observe(NOW, NOW + 5)
+
+    assert schedule.interval == 600
+    assert schedule.next_poll == NOW + 630
+
+
+def test_poll_after_a_failure_does_not_learn_the_gap():
+    schedule = SourceSchedule('weather', 60, state={'interval': 600, 'source_time': NOW})
+    schedule.observe(NOW + 600, NOW + 600)
+    schedule.failed(NOW + 700)
+    schedule.observe(NOW + 5000, NOW + 5000)
+
+    assert schedule.interval == 600
+
+
+def test_outage_of_the_source_is_not_learned():
+    schedule = SourceSchedule('weather', 60, state={'interval': 600, 'source_time': NOW})
+    schedule.observe(NOW, NOW)
+    schedule.observe(NOW + 86400, NOW + 86400)
+
+    assert schedule.interval == 600
+
+
+def test_longer_interval_is_learned_when_it_persists():
+    schedule = SourceSchedule('weather', 60, state={'interval': 600, 'source_time': NOW})
+    schedule.observe(NOW, NOW)
+    source_time = NOW
+    for _ in range(SourceSchedule.OUTLIER_LIMIT):
+        source_time += 3600
+        schedule.observe(source_time, source_time)
+
+    assert schedule.interval == 0.7 * 600 + 0.3 * 3600
+
+
+def test_failures_back_off_up_to_the_limit():
+    schedule = SourceSchedule('weather', 60, max_backoff=300)
+    delays = [schedule.failed(NOW) for _ in range(10)]
+
+    assert 30 <= delays[0] <= 60
+    assert all(150 <= delay <= 300 for delay in delays[4:])
+
+
+def test_slow_source_does_not_hold_back_the_others():
+    polls = []
+
+    def fast():
+        polls.append(time.monotonic())
+        return time.time()
+
+    def hanging():
+        time.sleep(4)
+        return time.time()
+
+    supervisor = Supervisor(4, 1.5)
+    scheduler = AdaptiveScheduler(supervisor=supervisor)
+    schedule = SourceSchedule('fast', 0.1, margin=0, state={'interval': 0.1})
+    scheduler.add(schedule, fast)
+    scheduler.add(SourceSchedule('hanging', 60), hanging)
+    thread = Thread(target=scheduler.run)
+    start = time.monotonic()
+    thread.start()
+    time.sleep(2.5)
+    scheduler.stop()
+    thread.join()
+    supervisor.close()
+
+    # polled all along while the other job ran into its deadline
+    assert polls[0] - start < 0.8
+    assert max(later - earlier for earlier, later in zip(polls, polls[1:])) < 0.8
+    assert polls[-1] - start > 2
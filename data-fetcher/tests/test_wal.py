@@ -0,0 +1,107 @@
+import time
+
+import pytest
+from requests.exceptions import ConnectionError
+
+from db import Database
+from points import Schema
+from wal import WriteAheadLog
+
+SCHEMA = Schema('wetter', ('location',), ('temperatur',))
+
+
+def points(count: int, start: int = 0) -> list:
+    return [SCHEMA.point((f'loc{index}',), index, (1.0,)) for index in range(start, start + count)]
+
+
+class Influx:
+    """ Stands in for Database._write_lines, records the batches or fails like an unreachable influxdb """
+
+    def __init__(self):
+        self.batches = []
+        self.down = False
+
+    def __call__(self, lines: str):
+        if self.down:
+            raise ConnectionError("influxdb is down")
+        self.batches.append(lines.split('\n'))
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'wal.sqlite')
+
+
+def test_flush_writes_everything_in_batches(path):
+    influx = Influx()
+    wal = WriteAheadLog(influx, path, batch_size=100, flush_interval=60)
+    wal.add(points(250))
+
+    assert wal.flush(5)
+    assert [len(batch) for batch in influx.batches] == [100, 100, 50]
+    assert wal.pending() == 0
+    wal.close()
+
+
+def test_points_are_kept_for_the_next_start(path):
+    influx = Influx()
+    influx.down = True
+    wal = WriteAheadLog(influx, path, batch_size=100, flush_interval=60, retry_interval=0.05)
+    wal.add(points(150))
+    wal.close(timeout=0.3)
+
+    influx.down = False
+    wal = WriteAheadLog(influx, path, batch_size=100, flush_interval=60)
+    assert wal.pending() == 150
+    assert wal.flush(5)
+    assert sum(len(batch) for batch in influx.batches) == 150
+    wal.close()
+
+
+def test_oldest_points_are_dropped_when_full(path):
+    influx = Influx()
+    influx.down = True
+    wal = WriteAheadLog(influx, path, batch_size=10, flush_interval=60, max_points=50, retry_interval=60)
+    for start in range(0, 100, 10):
+        wal.add(points(10, start))
+
+    assert wal.pending() == 50
+    influx.down = False
+    assert wal.flush(5)
+    assert influx.batches[-1][-1].startswith('wetter,location=loc99 ')
+    assert 'wetter,location=loc0 temperatur=1.0 0' not in sum(influx.batches, [])
+    wal.close()
+
+
+def test_log_is_used_by_one_process_at_a_time(path):
+    wal = WriteAheadLog(Influx(), path)
+    with pytest.raises(RuntimeError):
+        WriteAheadLog(Influx(), path)
+    wal.close()
+
+    # the lock is released on close
+    WriteAheadLog(Influx(), path).close()
+
+
+def test_second_database_uses_its_own_log(tmp_path):
+    credentials = {'host': 'localhost', 'port': 8086, 'username': '', 'password': '', 'dbname': 'wetter',
+                   'table_rki': 'rki', 'table_weather': 'wetter', 'wal_path': str(tmp_path)}
+    first, second = Database(credentials), Database(credentials)
+
+    assert first.buffer.path != second.buffer.path
+    first.buffer.close()
+    second.buffer.close()
+
+
+def test_idle_writer_does_not_spin(path):
+    influx = Influx()
+    wal = WriteAheadLog(influx, path, batch_size=100, flush_interval=0.05)
+    wal.add(points(10))
+    assert wal.flush(5)
+
+    # a flush of the empty log used to leave the thread polling an empty table
+    assert wal.flush(5)
+    start = time.process_time()
+    time.sleep(1)
+    assert time.process_time() - start < 0.5
+    wal.close()